@@ -43,7 +43,26 @@ ADVANCED USERS:
 
 import sys, os, time, datetime
 import multiprocessing, subprocess
-import shutil, psutil
+import shutil, psutil, math
+from chia_plotter_priority import (
+    MANAGE_PRIORITIES,
+    PRIORITY_CHECKING_INTERVAL,
+    run_with_background_priority,
+    update_plotting_priorities,
+)
+from chia_plotter_packing import (
+    PLOT_SIZES_GIB,
+    JOB_SEPARATOR,
+    plan_storage_drive_plots,
+    plannable_k_factors,
+)
+from chia_plotter_placement import LOAD_AWARE_PLACEMENT, select_plotting_drive
+from chia_plotter_inventory import (
+    RECLAIM_PARTIAL_PLOTS,
+    update_plot_inventory,
+    reclaim_partial_plots,
+    measured_plot_final_size_gib,
+)
 
 # configuration constants. these MUST be configured according to your mining machine, the chia software installed
 # and also the ssds and hdds installed
@@ -97,6 +116,13 @@ def print_debug(data=None):
         print()
 
 
+def delete_folders(folders_list):
+    for folder in folders_list:
+        if os.path.exists(folder):
+            print_debug("Deleting folder %s" % folder)
+            shutil.rmtree(folder)
+
+
 def clean_temporary_folders(
     plotting_drives_list=PLOTTING_DRIVES, temp_folders_prefix=TEMP_FOLDERS_PREFIX
 ):
@@ -108,10 +134,7 @@ def clean_temporary_folders(
             )
             folders_list.append(possible_folder)
 
-    for folder in folders_list:
-        if os.path.exists(folder):
-            print_debug("Deleting folder %s" % folder)
-            shutil.rmtree(folder)
+    run_with_background_priority(delete_folders, folders_list)
 
 
 def retrieve_plotting_drives_capabilities(
@@ -179,13 +202,29 @@ def retrieve_plotting_drives_capabilities(
     return cumulative_capabilities, plotting_drives_capabilities
 
 
+def format_plots_per_k_factor(plots_per_k_factor):
+    return ", ".join(
+        "k%d: %d" % (k_factor, plots_per_k_factor[k_factor])
+        for k_factor in sorted(plots_per_k_factor)
+    )
+
+
 def retrieve_storage_drives_capabilities(
-    storage_drives=STORAGE_DRIVES, plot_final_size_gib=PLOT_FINAL_SIZE_GIB
+    storage_drives=STORAGE_DRIVES,
+    plot_final_size_gib=PLOT_FINAL_SIZE_GIB,
+    k_factors=[K_FACTOR],
 ):
     storage_drives_capabilities = []
     total_available_storage_drives_space_gib = 0
     total_number_of_plots = 0
+    total_plots_per_k_factor = {k_factor: 0 for k_factor in k_factors}
     total_remaining_space_after_plots_gib = 0
+    plot_final_sizes_gib = {
+        k_factor: plot_final_size_gib
+        if k_factor == K_FACTOR
+        else PLOT_SIZES_GIB[k_factor]["final"]
+        for k_factor in k_factors
+    }
 
     for storage_drive in storage_drives:
         try:
@@ -194,27 +233,40 @@ def retrieve_storage_drives_capabilities(
             drive_available_space_gib = psutil.disk_usage(storage_drive).free / (
                 2 ** 30
             )
-            drive_number_of_plots = int(drive_available_space_gib / plot_final_size_gib)
-            drive_available_space_after_plots_gib = (
-                drive_available_space_gib - drive_number_of_plots * plot_final_size_gib
+            drive_plots_per_k_factor = plan_storage_drive_plots(
+                drive_available_space_gib, plot_final_sizes_gib
+            )
+            drive_number_of_plots = sum(drive_plots_per_k_factor.values())
+            drive_available_space_after_plots_gib = drive_available_space_gib - sum(
+                number_of_plots * plot_final_sizes_gib[k_factor]
+                for k_factor, number_of_plots in drive_plots_per_k_factor.items()
             )
             total_available_storage_drives_space_gib += drive_available_space_gib
             total_remaining_space_after_plots_gib += (
                 drive_available_space_after_plots_gib
             )
             total_number_of_plots += drive_number_of_plots
+            for k_factor, number_of_plots in drive_plots_per_k_factor.items():
+                total_plots_per_k_factor[k_factor] += number_of_plots
 
             storage_drives_capabilities.append(
                 {
                     "storage_drive": storage_drive,
                     "drive_available_space_gib": drive_available_space_gib,
                     "drive_number_of_plots": drive_number_of_plots,
+                    "drive_plots_per_k_factor": drive_plots_per_k_factor,
                     "drive_available_space_after_plots_gib": drive_available_space_after_plots_gib,
                 }
             )
 
             print_debug("\tAvailable space: %.2f GiB" % (drive_available_space_gib))
-            print_debug("\tPossible plots on this drive: %d" % drive_number_of_plots)
+            print_debug(
+                "\tPossible plots on this drive: %d (%s)"
+                % (
+                    drive_number_of_plots,
+                    format_plots_per_k_factor(drive_plots_per_k_factor),
+                )
+            )
             print_debug(
                 "\tRemaining space after plots: %.2f GiB"
                 % drive_available_space_after_plots_gib
@@ -227,6 +279,8 @@ def retrieve_storage_drives_capabilities(
         "total_available_storage_drives_space_gib": total_available_storage_drives_space_gib,
         "total_remaining_space_after_plots_gib": total_remaining_space_after_plots_gib,
         "total_number_of_plots": total_number_of_plots,
+        "total_plots_per_k_factor": total_plots_per_k_factor,
+        "plot_final_sizes_gib": plot_final_sizes_gib,
     }
 
     print_debug(
@@ -237,7 +291,10 @@ def retrieve_storage_drives_capabilities(
         "Total available space on storage drives after plots: %.2f GiB"
         % total_remaining_space_after_plots_gib
     )
-    print_debug("Max amount of plots to make: %d" % total_number_of_plots)
+    print_debug(
+        "Max amount of plots to make: %d (%s)"
+        % (total_number_of_plots, format_plots_per_k_factor(total_plots_per_k_factor))
+    )
     print_debug()
 
     return cumulative_capabilities, storage_drives_capabilities
@@ -272,6 +329,53 @@ def retrieve_cpu_ram_capabilities(
     return calculator_capabilities
 
 
+def generate_process_command(
+    temp_folder,
+    dest_folder,
+    process_jobs,
+    farmer_key=FARMER_KEY,
+    pool_key=POOL_KEY,
+    threads_per_plot=THREADS_PER_PLOT,
+):
+    return JOB_SEPARATOR.join(
+        "chia plots create -k %d -n %d -r %d -t %s -d %s -f %s -p %s"
+        % (
+            plot_k_factor,
+            plots,
+            threads_per_plot,
+            temp_folder,
+            dest_folder,
+            farmer_key,
+            pool_key,
+        )
+        for plot_k_factor, plots in process_jobs
+    )
+
+
+def merge_jobs(jobs):
+    plots_per_k_factor = {}
+    for plot_k_factor, plots in jobs:
+        plots_per_k_factor[plot_k_factor] = (
+            plots_per_k_factor.get(plot_k_factor, 0) + plots
+        )
+    return sorted(plots_per_k_factor.items(), reverse=True)
+
+
+def distribute_drive_plots(drive_plots_per_k_factor, assigned_processes):
+    # every plot, bigger first, goes to the process with the least plot data planned, so that the processes of a
+    # drive end at about the same time. processes left without plots get no jobs
+    process_loads_gib = [0] * assigned_processes
+    drive_jobs = [[] for process in range(assigned_processes)]
+    for plot_k_factor, drive_plots in sorted(
+        drive_plots_per_k_factor.items(), reverse=True
+    ):
+        for plot in range(drive_plots):
+            process = min(range(assigned_processes), key=lambda x: process_loads_gib[x])
+            process_loads_gib[process] += PLOT_SIZES_GIB[plot_k_factor]["final"]
+            drive_jobs[process].append((plot_k_factor, 1))
+    return [merge_jobs(jobs) for jobs in drive_jobs]
+
+
 def generate_parallel_processes(
     plotting_drives_capabilities,
     storage_drives_capabilities,
@@ -281,6 +385,7 @@ def generate_parallel_processes(
     k_factor=K_FACTOR,
     threads_per_plot=THREADS_PER_PLOT,
     temp_folder_prefix=TEMP_FOLDERS_PREFIX,
+    plot_temp_size_gib=PLOT_TEMP_SIZE_GIB,
 ):
     number_of_plots_to_do = storage_drives_capabilities[0]["total_number_of_plots"]
     max_parallel_plots_plotting_devices = plotting_drives_capabilities[0][
@@ -320,42 +425,29 @@ def generate_parallel_processes(
         storage_drives_assignments[0]["assigned_processes"] += 1
         current_process += 1
 
-    # calculate temp plotting folders
-    temp_folders = []
-    counter = 0
-    while len(temp_folders) < max_parallel_processes:
-        j = counter % len(plotting_drives_capabilities[1])
-        if plotting_drives_capabilities[1][j]["drive_parallel_plots"] > 0:
-            plotting_drives_capabilities[1][j]["drive_parallel_plots"] -= 1
-            temp_folders.append(plotting_drives_capabilities[1][j]["plotting_drive"])
-        counter += 1
-
-    # calculate destination folders and number of plots per process
+    # calculate destination folders and plots of each k size per process
     dest_folders = []
+    process_storage_drives = []
     process_plots = []
+    process_jobs = []
     for storage_drive_assignments in storage_drives_assignments:
         if storage_drive_assignments["assigned_processes"] > 0:
+            drive_jobs = distribute_drive_plots(
+                storage_drive_assignments["drive_plots_per_k_factor"],
+                storage_drive_assignments["assigned_processes"],
+            )
             print_debug(
                 "The storage drive %s will have %d process(es) assigned"
                 % (
                     storage_drive_assignments["storage_drive"],
-                    storage_drive_assignments["assigned_processes"],
+                    len([jobs for jobs in drive_jobs if len(jobs) > 0]),
                 )
             )
-            plots_per_process = int(
-                storage_drive_assignments["drive_number_of_plots"]
-                / storage_drive_assignments["assigned_processes"]
-            )
-            remaining_plots = int(
-                storage_drive_assignments["drive_number_of_plots"]
-                % storage_drive_assignments["assigned_processes"]
-            )
-            for process in range(storage_drive_assignments["assigned_processes"]):
+            for jobs in drive_jobs:
                 dest_folders.append(storage_drive_assignments["storage_drive"])
-                if process < remaining_plots:
-                    process_plots.append(plots_per_process + 1)
-                else:
-                    process_plots.append(plots_per_process)
+                process_storage_drives.append(storage_drive_assignments)
+                process_jobs.append(jobs)
+                process_plots.append(sum(job[1] for job in jobs))
         else:
             print_debug(
                 "The storage drive %s will have no process assigned"
@@ -363,24 +455,160 @@ def generate_parallel_processes(
             )
     print_debug()
 
+    # calculate temp plotting folders. processes making bigger plots need more temporary space, expressed as a
+    # number of plotting slots (plot_temp_size_gib each), they are placed first. processes without plots need none
+    process_temp_slots = [
+        max(
+            [1]
+            + [
+                math.ceil(PLOT_SIZES_GIB[job[0]]["temp"] / plot_temp_size_gib)
+                for job in jobs
+            ]
+        )
+        if len(jobs) > 0
+        else 0
+        for jobs in process_jobs
+    ]
+    available_temp_slots = sum(
+        x["drive_parallel_plots"] for x in plotting_drives_capabilities[1]
+    )
+    temp_folders = [None] * max_parallel_processes
+    counter = 0
+    for i in sorted(
+        range(max_parallel_processes), key=lambda x: process_temp_slots[x], reverse=True
+    ):
+        if process_temp_slots[i] == 0:
+            continue
+        required_temp_slots = sum(
+            process_temp_slots[x]
+            for x in range(max_parallel_processes)
+            if temp_folders[x] == None
+        )
+        plotting_drive_capabilities = None
+        if required_temp_slots <= available_temp_slots:
+            for attempt in range(len(plotting_drives_capabilities[1])):
+                j = (counter + attempt) % len(plotting_drives_capabilities[1])
+                if (
+                    plotting_drives_capabilities[1][j]["drive_parallel_plots"]
+                    >= process_temp_slots[i]
+                ):
+                    plotting_drive_capabilities = plotting_drives_capabilities[1][j]
+                    counter = j + 1
+                    break
+        if plotting_drive_capabilities == None:
+            storage_drive_assignments = process_storage_drives[i]
+            drive_processes = [
+                x
+                for x in range(max_parallel_processes)
+                if process_storage_drives[x] is storage_drive_assignments
+                and (temp_folders[x] != None or process_temp_slots[x] > 0)
+            ]
+            # processes already holding their temporary space come first
+            merging_processes = sorted(
+                [
+                    x
+                    for x in drive_processes
+                    if x != i and process_temp_slots[x] >= process_temp_slots[i]
+                ],
+                key=lambda x: temp_folders[x] == None,
+            )
+            if len(merging_processes) > 0:
+                # not enough temporary space for the bigger plots, they are chained after the plots of another
+                # process of the same storage drive that needs at least as much temporary space
+                print_debug(
+                    "Not enough temporary space for the bigger plots of process %d, process %d makes them"
+                    % (i, merging_processes[0])
+                )
+                process_jobs[merging_processes[0]] = merge_jobs(
+                    process_jobs[merging_processes[0]]
+                    + [job for job in process_jobs[i] if job[0] != k_factor]
+                )
+                process_jobs[i] = [job for job in process_jobs[i] if job[0] == k_factor]
+            else:
+                # not enough temporary space for the bigger plots, their storage drive is planned again with
+                # k_factor plots only and they are distributed among the processes of that drive
+                storage_drive_assignments[
+                    "drive_plots_per_k_factor"
+                ] = plan_storage_drive_plots(
+                    storage_drive_assignments["drive_available_space_gib"],
+                    {
+                        k_factor: storage_drives_capabilities[0][
+                            "plot_final_sizes_gib"
+                        ][k_factor]
+                    },
+                )
+                storage_drive_assignments["drive_number_of_plots"] = sum(
+                    storage_drive_assignments["drive_plots_per_k_factor"].values()
+                )
+                print_debug(
+                    "Not enough temporary space for the bigger plots of process %d, storage drive %s planned again with %d k%d plots"
+                    % (
+                        i,
+                        storage_drive_assignments["storage_drive"],
+                        storage_drive_assignments["drive_number_of_plots"],
+                        k_factor,
+                    )
+                )
+                for process, jobs in zip(
+                    drive_processes,
+                    distribute_drive_plots(
+                        storage_drive_assignments["drive_plots_per_k_factor"],
+                        len(drive_processes),
+                    ),
+                ):
+                    process_jobs[process] = jobs
+                    if (
+                        temp_folders[process] != None
+                        and process_temp_slots[process] > 1
+                    ):
+                        # the process already placed gives back the slots of its bigger plots
+                        for x in plotting_drives_capabilities[1]:
+                            if x["plotting_drive"] == temp_folders[process]:
+                                x["drive_parallel_plots"] += (
+                                    process_temp_slots[process] - 1
+                                )
+                        available_temp_slots += process_temp_slots[process] - 1
+                    process_temp_slots[process] = 1
+            for process in drive_processes:
+                process_plots[process] = sum(job[1] for job in process_jobs[process])
+            if len(process_jobs[i]) == 0:
+                process_temp_slots[i] = 0
+                continue
+            process_temp_slots[i] = 1
+            while plotting_drive_capabilities == None:
+                j = counter % len(plotting_drives_capabilities[1])
+                if plotting_drives_capabilities[1][j]["drive_parallel_plots"] > 0:
+                    plotting_drive_capabilities = plotting_drives_capabilities[1][j]
+                counter += 1
+        plotting_drive_capabilities["drive_parallel_plots"] -= process_temp_slots[i]
+        available_temp_slots -= process_temp_slots[i]
+        temp_folders[i] = plotting_drive_capabilities["plotting_drive"]
+
     # print_debug(temp_folders)
     # print_debug(dest_folders)
     # print_debug(process_plots)
 
+    # processes without plots are not launched
+    launched_processes = [
+        i for i in range(max_parallel_processes) if len(process_jobs[i]) > 0
+    ]
+    process_jobs = [process_jobs[i] for i in launched_processes]
+    process_plots = [process_plots[i] for i in launched_processes]
+    process_temp_slots = [process_temp_slots[i] for i in launched_processes]
+    temp_folders = [temp_folders[i] for i in launched_processes]
+    dest_folders = [dest_folders[i] for i in launched_processes]
+    max_parallel_processes = len(launched_processes)
+
     parallel_processes_commands = []
     for i in range(max_parallel_processes):
         temp_folder = os.path.join(temp_folders[i], "%s%d" % (temp_folder_prefix, i))
-        parallel_process_command = (
-            "chia plots create -k %d -n %d -r %d -t %s -d %s -f %s -p %s"
-            % (
-                k_factor,
-                process_plots[i],
-                threads_per_plot,
-                temp_folder,
-                dest_folders[i],
-                farmer_key,
-                pool_key,
-            )
+        parallel_process_command = generate_process_command(
+            temp_folder,
+            dest_folders[i],
+            process_jobs[i],
+            farmer_key,
+            pool_key,
+            threads_per_plot,
         )
         parallel_processes_commands.append(parallel_process_command)
         print_debug(
@@ -399,22 +627,49 @@ def generate_parallel_processes(
     return {
         "parallel_processes_commands": parallel_processes_commands,
         "single_process_plots": process_plots,
+        "single_process_jobs": process_jobs,
+        "single_process_temp_slots": process_temp_slots,
         "temp_folders": temp_folders,
         "dest_folders": dest_folders,
     }
 
 
 def run(parallel_process, executable_location=CHIA_LOCATION):
-    subprocess.call(
-        "start %s" % os.path.join(executable_location, parallel_process), shell=True
-    )
+    commands = [
+        os.path.join(executable_location, command)
+        for command in parallel_process.split(JOB_SEPARATOR)
+    ]
+    if len(commands) == 1:
+        subprocess.call("start %s" % commands[0], shell=True)
+    else:
+        subprocess.call('start cmd /c "%s"' % JOB_SEPARATOR.join(commands), shell=True)
 
 
 if __name__ == "__main__":
     clean_temporary_folders()
     plotting_drives_capabilities = retrieve_plotting_drives_capabilities()
-    storage_drives_capabilities = retrieve_storage_drives_capabilities()
+    max_plotting_drive_space_gib = max(
+        [0]
+        + [
+            x["drive_parallel_plots"] * PLOT_TEMP_SIZE_GIB
+            + x["drive_available_space_after_temp_gib"]
+            for x in plotting_drives_capabilities[1]
+        ]
+    )
+    plot_inventory = update_plot_inventory(STORAGE_DRIVES)
+    if RECLAIM_PARTIAL_PLOTS:
+        reclaim_partial_plots(plot_inventory)
+    storage_drives_capabilities = retrieve_storage_drives_capabilities(
+        plot_final_size_gib=measured_plot_final_size_gib(
+            plot_inventory, K_FACTOR, PLOT_FINAL_SIZE_GIB
+        ),
+        k_factors=plannable_k_factors(max_plotting_drive_space_gib),
+    )
     cpu_ram_capabilities = retrieve_cpu_ram_capabilities()
+    plotting_drives_temp_slots = {
+        x["plotting_drive"]: x["drive_parallel_plots"]
+        for x in plotting_drives_capabilities[1]
+    }
     parallel_processes = generate_parallel_processes(
         plotting_drives_capabilities, storage_drives_capabilities, cpu_ram_capabilities
     )
@@ -422,7 +677,39 @@ if __name__ == "__main__":
     if parallel_processes == 0:
         sys.exit(0)
 
-    for parallel_process in parallel_processes["parallel_processes_commands"]:
+    # processes making bigger plots keep their temporary drive, the others are placed at launch time
+    for i, temp_slots in enumerate(parallel_processes["single_process_temp_slots"]):
+        if temp_slots > 1:
+            plotting_drives_temp_slots[
+                parallel_processes["temp_folders"][i]
+            ] -= temp_slots
+
+    temp_folders = []
+    plotting_jobs = []
+    plotting_phases = {}
+    for i, parallel_process in enumerate(
+        parallel_processes["parallel_processes_commands"]
+    ):
+        if (
+            LOAD_AWARE_PLACEMENT
+            and parallel_processes["single_process_temp_slots"][i] == 1
+        ):
+            plotting_drive = select_plotting_drive(
+                plotting_drives_temp_slots, plotting_jobs
+            )
+            if plotting_drive != None:
+                plotting_drives_temp_slots[plotting_drive] -= 1
+                parallel_processes["temp_folders"][i] = plotting_drive
+                parallel_process = generate_process_command(
+                    os.path.join(plotting_drive, "%s%d" % (TEMP_FOLDERS_PREFIX, i)),
+                    parallel_processes["dest_folders"][i],
+                    parallel_processes["single_process_jobs"][i],
+                )
+        temp_folder = os.path.join(
+            parallel_processes["temp_folders"][i], "%s%d" % (TEMP_FOLDERS_PREFIX, i)
+        )
+        temp_folders.append(temp_folder)
+        plotting_jobs.append((parallel_processes["temp_folders"][i], temp_folder))
         print_debug("Launching process: %s" % parallel_process)
         p = multiprocessing.Process(target=run, args=(parallel_process,))
         p.start()
@@ -430,12 +717,25 @@ if __name__ == "__main__":
 
         print_debug("Next process will launch in %d seconds" % PROCESS_INTERVAL_SECONDS)
         start_time = time.time()
+        last_priority_check_time = 0
         while time.time() - start_time < PROCESS_INTERVAL_SECONDS:
+            if (
+                MANAGE_PRIORITIES
+                and time.time() - last_priority_check_time >= PRIORITY_CHECKING_INTERVAL
+            ):
+                print_debug()
+                update_plotting_priorities(temp_folders, plotting_phases)
+                last_priority_check_time = time.time()
             print(".", end="", flush=True)
             time.sleep(5)
         print_debug()
 
     print_debug()
+    if MANAGE_PRIORITIES:
+        print_debug("Managing the priorities of the plotting processes until they end")
+        while update_plotting_priorities(temp_folders, plotting_phases) > 0:
+            time.sleep(PRIORITY_CHECKING_INTERVAL)
+        print_debug()
     print_debug(
         "The script will now exit, check the processes within their respective shells"
     )
@@ -0,0 +1,194 @@
+"""
+This python module ties the plotting rate of madmax to the rate at which the mover drains the staging folder
+(DESTINATION_TEMPORARY_DRIVE/chia).
+
+It works as follows:
+    1 - every plot appearing into the staging folder and every plot moved out of it is recorded, the drain rate is
+        the amount of data moved by the moves completed during the last FLOW_CONTROL_WINDOW_SECONDS over the time
+        since the first of them started (no rate until one full move is in the window)
+    2 - when madmax starts a new plot (it goes back to phase 1) and it has finished copying the previous plot into
+        the staging folder, the staging backlog is projected: plots waiting in the staging folder plus the new plot
+    3 - if the backlog exceeds STAGING_BUDGET_GIB, or it would take more than STAGING_BUDGET_SECONDS to drain it,
+        madmax is suspended until the mover brings the backlog back within the budgets
+    4 - staging depth, drain rate, time spent waiting and sustained plot rate are reported
+
+madmax is never suspended while it is copying a finished plot into the staging folder, or when the staging folder
+holds no plot to drain, so it cannot wait forever.
+"""
+
+import os, glob, time, datetime
+import psutil
+from chia_plotter_priority import find_plotting_processes, detect_plotting_phase
+
+# constants - only advanced users should change them
+STAGING_BACKPRESSURE = True
+STAGING_BUDGET_GIB = 400
+STAGING_BUDGET_SECONDS = 7200
+FLOW_CONTROL_WINDOW_SECONDS = 6 * 3600
+FLOW_CONTROL_CHECKING_INTERVAL = 30
+
+
+def print_debug(data=None):
+    if data != None:
+        print("[%s]\t" % (datetime.datetime.now()) + data)
+    else:
+        print()
+
+
+def create_flow_control(staging_folder):
+    return {
+        "start_time": time.time(),
+        "produced_plots": [],  # (time, bytes)
+        "drained_plots": [],  # (time, bytes, move start time)
+        # the plots already staged at startup are not part of the plotting rate
+        "seen_plots": set(glob.glob(os.path.join(staging_folder, "*.plot"))),
+        "admitted": False,
+        "suspended_since": None,
+        "waiting_time": 0,
+    }
+
+
+def record_drained_plot(flow_control, plot_size, move_start_time):
+    flow_control["drained_plots"].append((time.time(), plot_size, move_start_time))
+
+
+def retrieve_staging_state(staging_folder):
+    staged_plots = {}
+    for plot_path in glob.glob(os.path.join(staging_folder, "*.plot")):
+        try:
+            staged_plots[plot_path] = os.path.getsize(plot_path)
+        except OSError:
+            pass
+    return {
+        "staged_plots": staged_plots,
+        "staged_bytes": sum(staged_plots.values()),
+        "copy_in_progress": len(glob.glob(os.path.join(staging_folder, "*.tmp"))) > 0,
+    }
+
+
+def window_rate(events, start_time, window_seconds=FLOW_CONTROL_WINDOW_SECONDS):
+    now = time.time()
+    window_start = max(start_time, now - window_seconds)
+    window_events = [event for event in events if event[0] >= window_start]
+    return (
+        len(window_events),
+        sum(event[1] for event in window_events),
+        max(now - window_start, 1),
+    )
+
+
+def drain_rate(flow_control, window_seconds=FLOW_CONTROL_WINDOW_SECONDS):
+    # bytes per second, None until a move started and completed within the window
+    now = time.time()
+    window_start = max(flow_control["start_time"], now - window_seconds)
+    full_moves = [
+        drained_plot
+        for drained_plot in flow_control["drained_plots"]
+        if drained_plot[2] >= window_start
+    ]
+    if len(full_moves) == 0:
+        return None
+    return sum(drained_plot[1] for drained_plot in full_moves) / max(
+        now - min(drained_plot[2] for drained_plot in full_moves), 1
+    )
+
+
+def update_flow_control(
+    flow_control,
+    temp_folder,
+    staging_folder,
+    plot_final_size_gib,
+    staging_budget_gib=STAGING_BUDGET_GIB,
+    staging_budget_seconds=STAGING_BUDGET_SECONDS,
+):
+    staging_state = retrieve_staging_state(staging_folder)
+    for plot_path, plot_size in staging_state["staged_plots"].items():
+        if plot_path not in flow_control["seen_plots"]:
+            flow_control["seen_plots"].add(plot_path)
+            flow_control["produced_plots"].append((time.time(), plot_size))
+
+    plotting_processes = find_plotting_processes(temp_folder)
+    if len(plotting_processes) == 0:
+        flow_control["suspended_since"] = None
+        return staging_state
+
+    phase = detect_plotting_phase(plotting_processes[0], temp_folder)
+    if phase != 1:
+        # the next time madmax is in phase 1 it is making a new plot
+        flow_control["admitted"] = False
+        return staging_state
+    if flow_control["admitted"] or staging_state["copy_in_progress"]:
+        # madmax starts the next plot while copying the previous one, the budget is checked once the copy is done
+        return staging_state
+
+    staging_drain_rate = drain_rate(flow_control)
+    projected_bytes = staging_state["staged_bytes"] + plot_final_size_gib * 2 ** 30
+    over_budget = projected_bytes > staging_budget_gib * 2 ** 30 or (
+        staging_drain_rate != None
+        and staging_drain_rate > 0
+        and projected_bytes / staging_drain_rate > staging_budget_seconds
+    )
+
+    if over_budget and staging_state["staged_bytes"] > 0:
+        if flow_control["suspended_since"] == None:
+            print_debug(
+                "Staging backlog of %.2f GiB over budget, madmax waits for the mover"
+                % (projected_bytes / 2 ** 30)
+            )
+            for plotting_process in plotting_processes:
+                try:
+                    plotting_process.suspend()
+                except psutil.Error:
+                    print_debug("\tUnable to suspend process %d" % plotting_process.pid)
+            flow_control["suspended_since"] = time.time()
+    else:
+        flow_control["admitted"] = True
+        if flow_control["suspended_since"] != None:
+            flow_control["waiting_time"] += (
+                time.time() - flow_control["suspended_since"]
+            )
+            flow_control["suspended_since"] = None
+            print_debug("Staging backlog within budget, madmax resumes")
+            for plotting_process in plotting_processes:
+                try:
+                    plotting_process.resume()
+                except psutil.Error:
+                    print_debug("\tUnable to resume process %d" % plotting_process.pid)
+
+    return staging_state
+
+
+def release_flow_control(flow_control, temp_folder):
+    # a suspended madmax keeps holding its temporary space, it must not outlive the mover
+    if flow_control["suspended_since"] == None:
+        return
+    flow_control["suspended_since"] = None
+    print_debug("Resuming madmax before exiting")
+    for plotting_process in find_plotting_processes(temp_folder):
+        try:
+            plotting_process.resume()
+        except psutil.Error:
+            print_debug("\tUnable to resume process %d" % plotting_process.pid)
+
+
+def report_flow_control(flow_control, staging_state):
+    produced_count, produced_bytes, produced_seconds = window_rate(
+        flow_control["produced_plots"], flow_control["start_time"]
+    )
+    staging_drain_rate = drain_rate(flow_control)
+    waiting_time = flow_control["waiting_time"]
+    if flow_control["suspended_since"] != None:
+        waiting_time += time.time() - flow_control["suspended_since"]
+
+    print_debug(
+        "Staging: %d plots (%.2f GiB), drain rate %s, madmax waited %.1f minutes, sustained rate %.2f plots/hour"
+        % (
+            len(staging_state["staged_plots"]),
+            staging_state["staged_bytes"] / 2 ** 30,
+            "%.2f MiB/s" % (staging_drain_rate / 2 ** 20)
+            if staging_drain_rate != None
+            else "not measured yet",
+            waiting_time / 60,
+            produced_count * 3600 / produced_seconds,
+        )
+    )
@@ -0,0 +1,204 @@
+"""
+This python module keeps a persistent inventory of the plots stored into the storage drives.
+
+It works as follows:
+    1 - load the inventory saved by the previous run (INVENTORY_FILE)
+    2 - for each directory of the storage drives compare its modification time with the saved one, only the
+        directories that changed are listed again (a rescan of many drives with thousands of plots costs one stat
+        call per directory)
+    3 - record the size of every plot and of every partial plot (.tmp files left by interrupted copies)
+    4 - report the plots found on more than one drive and the partial plots that can be reclaimed
+    5 - save the inventory for the next run
+
+The measured plot sizes replace the PLOT_FINAL_SIZE_GIB estimate in the capacity planning.
+"""
+
+import os, re, json, datetime, time
+
+# constants - only advanced users should change them
+INVENTORY_FILE = "chia_plot_inventory.json"
+INVENTORY_SCAN_DEPTH = 1  # 0 scans only the root of each drive
+RECLAIM_PARTIAL_PLOTS = True
+PARTIAL_PLOT_MIN_AGE_SECONDS = 86400  # partials still being written are newer than this
+
+PLOT_FILE_PATTERN = re.compile(r"^plot-k(\d+)-.*\.plot$")
+PARTIAL_PLOT_FILE_PATTERN = re.compile(r"^plot-k(\d+)-.*\.tmp$")
+
+
+def print_debug(data=None):
+    if data != None:
+        print("[%s]\t" % (datetime.datetime.now()) + data)
+    else:
+        print()
+
+
+def load_plot_inventory(inventory_file=INVENTORY_FILE):
+    try:
+        with open(inventory_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"drives": {}}
+
+
+def save_plot_inventory(plot_inventory, inventory_file=INVENTORY_FILE):
+    temporary_inventory_file = inventory_file + ".tmp"
+    with open(temporary_inventory_file, "w") as f:
+        json.dump(plot_inventory, f)
+    os.replace(temporary_inventory_file, inventory_file)
+
+
+def scan_directory(directory, cached_directories, scanned_directories, depth):
+    try:
+        directory_mtime_ns = os.stat(directory).st_mtime_ns
+    except OSError:
+        return
+
+    cached_directory = cached_directories.get(directory)
+    if (
+        cached_directory is not None
+        and cached_directory["mtime_ns"] == directory_mtime_ns
+    ):
+        scanned_directory = cached_directory
+    else:
+        scanned_directory = {
+            "mtime_ns": directory_mtime_ns,
+            "plots": {},
+            "partials": {},
+            "subdirectories": [],
+        }
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith((".", "$")):
+                            scanned_directory["subdirectories"].append(entry.path)
+                    elif PLOT_FILE_PATTERN.match(entry.name):
+                        scanned_directory["plots"][entry.name] = entry.stat().st_size
+                    elif PARTIAL_PLOT_FILE_PATTERN.match(entry.name):
+                        entry_stat = entry.stat()
+                        scanned_directory["partials"][entry.name] = [
+                            entry_stat.st_size,
+                            entry_stat.st_mtime,
+                        ]
+        except OSError:
+            print_debug("\tError scanning directory %s" % directory)
+            return
+    scanned_directories[directory] = scanned_directory
+
+    if depth > 0:
+        for subdirectory in scanned_directory["subdirectories"]:
+            scan_directory(
+                subdirectory, cached_directories, scanned_directories, depth - 1
+            )
+
+
+def update_plot_inventory(
+    storage_drives,
+    inventory_file=INVENTORY_FILE,
+    inventory_scan_depth=INVENTORY_SCAN_DEPTH,
+):
+    plot_inventory = load_plot_inventory(inventory_file)
+    start_time = time.time()
+
+    drives = {}
+    for storage_drive in storage_drives:
+        scanned_directories = {}
+        scan_directory(
+            storage_drive,
+            plot_inventory["drives"].get(storage_drive, {}),
+            scanned_directories,
+            inventory_scan_depth,
+        )
+        drives[storage_drive] = scanned_directories
+    plot_inventory["drives"] = drives
+
+    try:
+        save_plot_inventory(plot_inventory, inventory_file)
+    except OSError:
+        print_debug("Error saving the plot inventory %s" % inventory_file)
+
+    print_debug("Plot inventory updated in %.2f seconds" % (time.time() - start_time))
+    report_plot_inventory(plot_inventory)
+
+    return plot_inventory
+
+
+def report_plot_inventory(plot_inventory):
+    plot_locations = {}
+    for storage_drive, directories in plot_inventory["drives"].items():
+        drive_plots = 0
+        drive_plots_size = 0
+        drive_partials_size = 0
+        for directory, scanned_directory in directories.items():
+            for plot_name, plot_size in scanned_directory["plots"].items():
+                plot_locations.setdefault(plot_name, []).append(directory)
+                drive_plots += 1
+                drive_plots_size += plot_size
+            for partial_size, partial_mtime in scanned_directory["partials"].values():
+                drive_partials_size += partial_size
+        print_debug(
+            "Storage drive %s holds %d plots (%.2f GiB) and %.2f GiB of partial plots"
+            % (
+                storage_drive,
+                drive_plots,
+                drive_plots_size / 2 ** 30,
+                drive_partials_size / 2 ** 30,
+            )
+        )
+
+    for plot_name, directories in plot_locations.items():
+        if len(directories) > 1:
+            print_debug(
+                "Plot %s is duplicated in %s" % (plot_name, ", ".join(directories))
+            )
+    print_debug()
+
+
+def measured_plot_final_size_gib(plot_inventory, k_factor, default_plot_final_size_gib):
+    plots = 0
+    plots_size = 0
+    for directories in plot_inventory["drives"].values():
+        for scanned_directory in directories.values():
+            for plot_name, plot_size in scanned_directory["plots"].items():
+                if int(PLOT_FILE_PATTERN.match(plot_name).group(1)) == k_factor:
+                    plots += 1
+                    plots_size += plot_size
+
+    if plots == 0:
+        return default_plot_final_size_gib
+
+    # the biggest plots are up to 1% larger than the average, keep the margin
+    plot_final_size_gib = plots_size / plots / 2 ** 30 * 1.01
+    print_debug(
+        "Measured size of k%d plots over %d plots: %.2f GiB"
+        % (k_factor, plots, plot_final_size_gib)
+    )
+    return plot_final_size_gib
+
+
+def reclaim_partial_plots(
+    plot_inventory, partial_plot_min_age_seconds=PARTIAL_PLOT_MIN_AGE_SECONDS
+):
+    reclaimed_space = 0
+    for directories in plot_inventory["drives"].values():
+        for directory, scanned_directory in directories.items():
+            for partial_name, (partial_size, partial_mtime) in list(
+                scanned_directory["partials"].items()
+            ):
+                if time.time() - partial_mtime < partial_plot_min_age_seconds:
+                    continue
+                partial_path = os.path.join(directory, partial_name)
+                try:
+                    print_debug("Deleting partial plot %s" % partial_path)
+                    os.remove(partial_path)
+                    reclaimed_space += partial_size
+                    del scanned_directory["partials"][partial_name]
+                except OSError:
+                    print_debug("\tError deleting partial plot %s" % partial_path)
+
+    if reclaimed_space > 0:
+        print_debug(
+            "Reclaimed %.2f GiB of partial plots\n" % (reclaimed_space / 2 ** 30)
+        )
+
+    return reclaimed_space
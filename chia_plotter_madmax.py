@@ -25,6 +25,8 @@ HOW TO USE THE SCRIPT:
         - MADMAX_CHIA_LOCATION
         - FARMER_KEY
         - POOL_KEY
+       optionally MADMAX_CHIA_PLOTTER_K34_LOCATION (the chia_plot_k34 build of madmax), without it only k32 plots
+       are made
     2 - run the script
 
 IF THE SCRIPT FAILS TO LAUNCH:
@@ -33,7 +35,36 @@ IF THE SCRIPT FAILS TO LAUNCH:
 
 import sys, os, time, datetime
 import multiprocessing, subprocess
-import shutil, psutil, glob
+import shutil, psutil, glob, re
+from chia_plotter_priority import (
+    MANAGE_PRIORITIES,
+    run_with_background_priority,
+    update_plotting_priorities,
+)
+from chia_plotter_packing import (
+    PLANNED_K_FACTORS,
+    PLOT_SIZES_GIB,
+    JOB_SEPARATOR,
+    plan_storage_drive_plots,
+)
+from chia_plotter_tuner import load_tuned_configuration
+from chia_plotter_transfer import move_plot
+from chia_plotter_network import REMOTE_HARVESTERS, send_plots
+from chia_plotter_backpressure import (
+    STAGING_BACKPRESSURE,
+    FLOW_CONTROL_CHECKING_INTERVAL,
+    create_flow_control,
+    record_drained_plot,
+    update_flow_control,
+    release_flow_control,
+    report_flow_control,
+)
+from chia_plotter_inventory import (
+    RECLAIM_PARTIAL_PLOTS,
+    update_plot_inventory,
+    reclaim_partial_plots,
+    measured_plot_final_size_gib,
+)
 
 # configuration constants. these MUST be configured according to your mining machine, the chia software installed
 # and also the ssds and hdds installed
@@ -66,6 +97,9 @@ STORAGE_DRIVES = [
     "Z:/",
 ]  # example ["E:/", "F:/", "G:/", "H:/", "I:/"]
 MADMAX_CHIA_PLOTTER_LOCATION = "./build/chia_plot"
+MADMAX_CHIA_PLOTTER_K34_LOCATION = (
+    ""  # example "./build/chia_plot_k34", needed for k33 and k34 plots
+)
 FARMER_KEY = "a3d6fd875db16e7ccc98ffda929779c1abf9ae852674c5ec7de630defa73852894f131620dafc33874408c8e842ad606"
 POOL_KEY = "ae6c61298964c91bbf1ab2b37dece103406ce8012b938f0edddd8ed53074790b839e25008587845317fe24fffbfe3182"
 
@@ -74,7 +108,18 @@ SLOW_DIR_MIN_AVAILABLE_SPACE = 220
 FAST_DIR_MIN_AVAILABLE_SPACE = 110
 COMBINED_DIR_MIN_AVAILABLE_SPACE = 150  # 256
 PLOT_TEMP_SIZE_GIB = 239
-PLOT_FINAL_SIZE_GIB = 10.13
+PLOT_FINAL_SIZE_GIB = 101.3
+K_FACTOR = 32
+# madmax temporary space for each k size: temp (-t), temp2 (-2) and both on the same drive
+MADMAX_TEMP_SIZES_GIB = {
+    32: {
+        "temp": SLOW_DIR_MIN_AVAILABLE_SPACE,
+        "temp2": FAST_DIR_MIN_AVAILABLE_SPACE,
+        "combined": COMBINED_DIR_MIN_AVAILABLE_SPACE,
+    },
+    33: {"temp": 440, "temp2": 220, "combined": 300},
+    34: {"temp": 880, "temp2": 440, "combined": 600},
+}
 RAM_MIB_PER_THREAD = 512
 CHECKING_INTERVAL = 300
 
@@ -86,19 +131,24 @@ def print_debug(data=None):
         print()
 
 
+def delete_folders(folders_list):
+    for folder in folders_list:
+        if os.path.exists(folder):
+            print_debug("Deleting folder %s" % folder)
+            shutil.rmtree(folder)
+
+
 def clean_temporary_folders(
     plotting_slow_drive=PLOTTING_SLOW_DRIVE,
     plotting_fast_drive=PLOTTING_FAST_DRIVE,
 ):
-    plotting_slow_directory = os.path.join(plotting_slow_drive, "chia", "temp_slow")
-    if os.path.exists(plotting_slow_directory):
-        print_debug("Deleting folder %s" % plotting_slow_directory)
-        shutil.rmtree(plotting_slow_directory)
-
-    plotting_fast_directory = os.path.join(plotting_fast_drive, "chia", "temp_fast")
-    if os.path.exists(plotting_fast_directory):
-        print_debug("Deleting folder %s" % plotting_fast_directory)
-        shutil.rmtree(plotting_fast_directory)
+    run_with_background_priority(
+        delete_folders,
+        [
+            os.path.join(plotting_slow_drive, "chia", "temp_slow"),
+            os.path.join(plotting_fast_drive, "chia", "temp_fast"),
+        ],
+    )
 
 
 def check_directories_available_space(
@@ -227,13 +277,82 @@ def check_directories_available_space(
     return True
 
 
+def retrieve_plannable_k_factors(
+    plot_final_size_gib=PLOT_FINAL_SIZE_GIB,
+    plotting_slow_drive=PLOTTING_SLOW_DRIVE,
+    plotting_fast_drive=PLOTTING_FAST_DRIVE,
+    destination_temporary_drive=DESTINATION_TEMPORARY_DRIVE,
+    k_factors=PLANNED_K_FACTORS,
+    madmax_temp_sizes_gib=MADMAX_TEMP_SIZES_GIB,
+    madmax_chia_plotter_k34_location=MADMAX_CHIA_PLOTTER_K34_LOCATION,
+):
+    # a k size is planned only if its temp, temp2 and final plot fit, the spaces add up when they share a drive
+    plannable_k_factors = []
+    for k_factor in k_factors:
+        if k_factor > K_FACTOR and madmax_chia_plotter_k34_location == "":
+            print_debug(
+                "MADMAX_CHIA_PLOTTER_K34_LOCATION not configured, k%d plots are not planned"
+                % k_factor
+            )
+            continue
+        if plotting_slow_drive == plotting_fast_drive:
+            required_spaces_gib = {
+                plotting_slow_drive: madmax_temp_sizes_gib[k_factor]["combined"]
+            }
+        else:
+            required_spaces_gib = {
+                plotting_slow_drive: madmax_temp_sizes_gib[k_factor]["temp"],
+                plotting_fast_drive: madmax_temp_sizes_gib[k_factor]["temp2"],
+            }
+        required_spaces_gib[destination_temporary_drive] = required_spaces_gib.get(
+            destination_temporary_drive, 0
+        ) + (
+            plot_final_size_gib
+            if k_factor == K_FACTOR
+            else PLOT_SIZES_GIB[k_factor]["final"]
+        )
+
+        missing_space_drives = []
+        for drive, required_space_gib in required_spaces_gib.items():
+            try:
+                if psutil.disk_usage(drive).free / (2 ** 30) < required_space_gib:
+                    missing_space_drives.append(drive)
+            except OSError:
+                missing_space_drives.append(drive)
+        if k_factor == K_FACTOR or len(missing_space_drives) == 0:
+            plannable_k_factors.append(k_factor)
+        else:
+            print_debug(
+                "Not enough space on %s for k%d plots, they are not planned"
+                % (", ".join(missing_space_drives), k_factor)
+            )
+
+    return plannable_k_factors
+
+
+def format_plots_per_k_factor(plots_per_k_factor):
+    return ", ".join(
+        "k%d: %d" % (k_factor, plots_per_k_factor[k_factor])
+        for k_factor in sorted(plots_per_k_factor)
+    )
+
+
 def retrieve_storage_drives_capabilities(
-    storage_drives=STORAGE_DRIVES, plot_final_size_gib=PLOT_FINAL_SIZE_GIB
+    storage_drives=STORAGE_DRIVES,
+    plot_final_size_gib=PLOT_FINAL_SIZE_GIB,
+    k_factors=[K_FACTOR],
 ):
     storage_drives_capabilities = []
     total_available_storage_drives_space_gib = 0
     total_number_of_plots = 0
+    total_plots_per_k_factor = {k_factor: 0 for k_factor in k_factors}
     total_remaining_space_after_plots_gib = 0
+    plot_final_sizes_gib = {
+        k_factor: plot_final_size_gib
+        if k_factor == K_FACTOR
+        else PLOT_SIZES_GIB[k_factor]["final"]
+        for k_factor in k_factors
+    }
 
     for storage_drive in storage_drives:
         try:
@@ -242,27 +361,40 @@ def retrieve_storage_drives_capabilities(
             drive_available_space_gib = psutil.disk_usage(storage_drive).free / (
                 2 ** 30
             )
-            drive_number_of_plots = int(drive_available_space_gib / plot_final_size_gib)
-            drive_available_space_after_plots_gib = (
-                drive_available_space_gib - drive_number_of_plots * plot_final_size_gib
+            drive_plots_per_k_factor = plan_storage_drive_plots(
+                drive_available_space_gib, plot_final_sizes_gib
+            )
+            drive_number_of_plots = sum(drive_plots_per_k_factor.values())
+            drive_available_space_after_plots_gib = drive_available_space_gib - sum(
+                number_of_plots * plot_final_sizes_gib[k_factor]
+                for k_factor, number_of_plots in drive_plots_per_k_factor.items()
             )
             total_available_storage_drives_space_gib += drive_available_space_gib
             total_remaining_space_after_plots_gib += (
                 drive_available_space_after_plots_gib
             )
             total_number_of_plots += drive_number_of_plots
+            for k_factor, number_of_plots in drive_plots_per_k_factor.items():
+                total_plots_per_k_factor[k_factor] += number_of_plots
 
             storage_drives_capabilities.append(
                 {
                     "storage_drive": storage_drive,
                     "drive_available_space_gib": drive_available_space_gib,
                     "drive_number_of_plots": drive_number_of_plots,
+                    "drive_plots_per_k_factor": drive_plots_per_k_factor,
                     "drive_available_space_after_plots_gib": drive_available_space_after_plots_gib,
                 }
             )
 
             print_debug("\tAvailable space: %.2f GiB" % (drive_available_space_gib))
-            print_debug("\tPossible plots on this drive: %d" % drive_number_of_plots)
+            print_debug(
+                "\tPossible plots on this drive: %d (%s)"
+                % (
+                    drive_number_of_plots,
+                    format_plots_per_k_factor(drive_plots_per_k_factor),
+                )
+            )
             print_debug(
                 "\tRemaining space after plots: %.2f GiB"
                 % drive_available_space_after_plots_gib
@@ -275,6 +407,7 @@ def retrieve_storage_drives_capabilities(
         "total_available_storage_drives_space_gib": total_available_storage_drives_space_gib,
         "total_remaining_space_after_plots_gib": total_remaining_space_after_plots_gib,
         "total_number_of_plots": total_number_of_plots,
+        "total_plots_per_k_factor": total_plots_per_k_factor,
     }
 
     print_debug(
@@ -285,7 +418,10 @@ def retrieve_storage_drives_capabilities(
         "Total available space on storage drives after plots: %.2f GiB"
         % total_remaining_space_after_plots_gib
     )
-    print_debug("Max amount of plots to make: %d" % total_number_of_plots)
+    print_debug(
+        "Max amount of plots to make: %d (%s)"
+        % (total_number_of_plots, format_plots_per_k_factor(total_plots_per_k_factor))
+    )
     print_debug()
 
     return cumulative_capabilities, storage_drives_capabilities
@@ -327,8 +463,10 @@ def generate_command_to_run(
     plotting_fast_drive=PLOTTING_FAST_DRIVE,
     destination_temporary_drive=DESTINATION_TEMPORARY_DRIVE,
     madmax_chia_plotter_location=MADMAX_CHIA_PLOTTER_LOCATION,
+    madmax_chia_plotter_k34_location=MADMAX_CHIA_PLOTTER_K34_LOCATION,
+    tuned_configuration=None,
 ):
-    number_of_plots_to_do = storage_drives_capabilities[0]["total_number_of_plots"]
+    plots_per_k_factor = storage_drives_capabilities[0]["total_plots_per_k_factor"]
     max_parallel_threads = cpu_ram_capabilities[
         "max_calculator_parallel_plotting_processes"
     ]
@@ -342,15 +480,50 @@ def generate_command_to_run(
         % max_parallel_threads
     )
 
-    madmax_process_command = "%s -n %d -r %d -t %s -2 %s -d %s -f %s -p %s" % (
-        madmax_chia_plotter_location,
-        number_of_plots_to_do,
-        max_parallel_threads,
-        os.path.join(plotting_slow_drive, "chia", "temp_slow"),
-        os.path.join(plotting_fast_drive, "chia", "temp_fast"),
-        os.path.join(destination_temporary_drive, "chia"),
-        farmer_key,
-        pool_key,
+    madmax_threads = max_parallel_threads
+    madmax_buckets = ""
+    plotting_temp2_directory = os.path.join(plotting_fast_drive, "chia", "temp_fast")
+    if tuned_configuration != None:
+        print_debug(
+            "Using the tuned configuration of this calculator: %d threads, %d buckets (%d for phases 3-4), temp2 on the %s drive"
+            % (
+                tuned_configuration["threads"],
+                tuned_configuration["buckets"],
+                tuned_configuration["buckets3"],
+                "fast" if tuned_configuration["temp2_fast"] else "slow",
+            )
+        )
+        madmax_threads = tuned_configuration["threads"]
+        madmax_buckets = " -u %d -v %d" % (
+            tuned_configuration["buckets"],
+            tuned_configuration["buckets3"],
+        )
+        if not tuned_configuration["temp2_fast"]:
+            plotting_temp2_directory = os.path.join(
+                plotting_slow_drive, "chia", "temp_slow"
+            )
+
+    # one madmax run for each k size, bigger plots first. the default build of madmax supports only k_factor plots
+    madmax_process_command = JOB_SEPARATOR.join(
+        "%s -k %d -n %d -r %d%s -t %s -2 %s -d %s -f %s -p %s"
+        % (
+            madmax_chia_plotter_k34_location
+            if k_factor > K_FACTOR
+            else madmax_chia_plotter_location,
+            k_factor,
+            number_of_plots,
+            madmax_threads,
+            madmax_buckets,
+            os.path.join(plotting_slow_drive, "chia", "temp_slow"),
+            plotting_temp2_directory,
+            os.path.join(destination_temporary_drive, "chia"),
+            farmer_key,
+            pool_key,
+        )
+        for k_factor, number_of_plots in sorted(
+            plots_per_k_factor.items(), reverse=True
+        )
+        if number_of_plots > 0 or k_factor == K_FACTOR
     )
 
     print_debug("Command to run:\t%s" % madmax_process_command)
@@ -359,17 +532,33 @@ def generate_command_to_run(
 
 
 def run(parallel_process):
-    subprocess.call("start %s" % parallel_process, shell=True)
+    if JOB_SEPARATOR in parallel_process:
+        subprocess.call('start cmd /c "%s"' % parallel_process, shell=True)
+    else:
+        subprocess.call("start %s" % parallel_process, shell=True)
 
 
 if __name__ == "__main__":
     clean_temporary_folders()
     if check_directories_available_space() == False:
         sys.exit(0)
-    storage_drives_capabilities = retrieve_storage_drives_capabilities()
+    plot_inventory = update_plot_inventory(STORAGE_DRIVES)
+    if RECLAIM_PARTIAL_PLOTS:
+        reclaim_partial_plots(plot_inventory)
+    plot_final_size_gib = measured_plot_final_size_gib(
+        plot_inventory, K_FACTOR, PLOT_FINAL_SIZE_GIB
+    )
+    k_factors = retrieve_plannable_k_factors(plot_final_size_gib)
+    storage_drives_capabilities = retrieve_storage_drives_capabilities(
+        plot_final_size_gib=plot_final_size_gib, k_factors=k_factors
+    )
     cpu_ram_capabilities = retrieve_cpu_ram_capabilities()
     command_to_run = generate_command_to_run(
-        storage_drives_capabilities, cpu_ram_capabilities
+        storage_drives_capabilities,
+        cpu_ram_capabilities,
+        tuned_configuration=load_tuned_configuration(
+            PLOTTING_SLOW_DRIVE, PLOTTING_FAST_DRIVE
+        ),
     )
 
     if command_to_run == 0:
@@ -379,24 +568,91 @@ if __name__ == "__main__":
     p.start()
     p.join()
 
-    while True:
-        storage_drives_capabilities = retrieve_storage_drives_capabilities()
-        fileList = glob.glob(
-            os.path.join(os.path.join(DESTINATION_TEMPORARY_DRIVE, "chia"), "*.plot")
-        )
-        if len(fileList) == 0:
-            print_debug(
-                "No new plot to move. Checking again in %d seconds" % CHECKING_INTERVAL
+    plotting_phases = {}
+    plotting_temp_folder = os.path.join(PLOTTING_SLOW_DRIVE, "chia", "temp_slow")
+    staging_folder = os.path.join(DESTINATION_TEMPORARY_DRIVE, "chia")
+    flow_control = create_flow_control(staging_folder)
+    try:
+        while True:
+            if MANAGE_PRIORITIES:
+                update_plotting_priorities(
+                    [os.path.join(PLOTTING_SLOW_DRIVE, "chia", "temp_slow")],
+                    plotting_phases,
+                )
+            plot_inventory = update_plot_inventory(STORAGE_DRIVES)
+            if RECLAIM_PARTIAL_PLOTS:
+                reclaim_partial_plots(plot_inventory)
+            storage_drives_capabilities = retrieve_storage_drives_capabilities(
+                plot_final_size_gib=plot_final_size_gib, k_factors=k_factors
             )
-            time.sleep(CHECKING_INTERVAL)
-        else:
-            for f in fileList:
-                storage_drives_assignments = sorted(
-                    storage_drives_capabilities[1],
-                    key=lambda x: x["drive_number_of_plots"],
-                    reverse=True,
+            if STAGING_BACKPRESSURE:
+                staging_state = update_flow_control(
+                    flow_control,
+                    plotting_temp_folder,
+                    staging_folder,
+                    plot_final_size_gib,
+                )
+                report_flow_control(flow_control, staging_state)
+            fileList = glob.glob(
+                os.path.join(
+                    os.path.join(DESTINATION_TEMPORARY_DRIVE, "chia"), "*.plot"
+                )
+            )
+            if len(fileList) == 0:
+                print_debug(
+                    "No new plot to move. Checking again in %d seconds"
+                    % CHECKING_INTERVAL
                 )
-                destination_folder = storage_drives_assignments[0]["storage_drive"]
-                print_debug("Moving plot %s to %s" % (f, destination_folder))
-                shutil.move(f, destination_folder)
-                print_debug("\tmove done")
+                if STAGING_BACKPRESSURE:
+                    # madmax can start a new plot in the meantime
+                    start_time = time.time()
+                    while time.time() - start_time < CHECKING_INTERVAL:
+                        time.sleep(FLOW_CONTROL_CHECKING_INTERVAL)
+                        update_flow_control(
+                            flow_control,
+                            plotting_temp_folder,
+                            staging_folder,
+                            plot_final_size_gib,
+                        )
+                else:
+                    time.sleep(CHECKING_INTERVAL)
+            else:
+                plot_sizes = {f: os.path.getsize(f) for f in fileList}
+                if len(REMOTE_HARVESTERS) > 0:
+                    # the plots that no harvester could take go to the local storage drives
+                    move_start_time = time.time()
+                    sent_plots = run_with_background_priority(
+                        send_plots, fileList, REMOTE_HARVESTERS
+                    )
+                    for f in sent_plots:
+                        record_drained_plot(
+                            flow_control, plot_sizes[f], move_start_time
+                        )
+                    fileList = [f for f in fileList if f not in sent_plots]
+                for f in fileList:
+                    # the drives planned for plots of this k size come first
+                    match = re.match(r"plot-k(\d+)-", os.path.basename(f))
+                    plot_k_factor = int(match.group(1)) if match else K_FACTOR
+                    storage_drives_assignments = sorted(
+                        storage_drives_capabilities[1],
+                        key=lambda x: (
+                            x["drive_plots_per_k_factor"].get(plot_k_factor, 0),
+                            x["drive_number_of_plots"],
+                        ),
+                        reverse=True,
+                    )
+                    destination_folder = storage_drives_assignments[0]["storage_drive"]
+                    print_debug("Moving plot %s to %s" % (f, destination_folder))
+                    move_start_time = time.time()
+                    run_with_background_priority(move_plot, f, destination_folder)
+                    print_debug("\tmove done")
+                    record_drained_plot(flow_control, plot_sizes[f], move_start_time)
+                    if STAGING_BACKPRESSURE:
+                        update_flow_control(
+                            flow_control,
+                            plotting_temp_folder,
+                            staging_folder,
+                            plot_final_size_gib,
+                        )
+    finally:
+        release_flow_control(flow_control, plotting_temp_folder)
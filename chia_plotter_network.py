@@ -0,0 +1,406 @@
+"""
+This python script moves the finished plots to remote harvesters through the network, without SMB/NFS mounts.
+
+It works as follows:
+    1 - on each harvester this script runs as a receiver daemon, it advertises its storage drives and their free space
+    2 - the mover of the plotting machine (chia_plotter_madmax.py) opens one stream per harvester in parallel, each
+        stream takes the next plot as soon as it is free and sends it over TCP if its harvester has room for it. the
+        receiver writes the plot into its storage drive with the most free space
+    3 - the receiver writes the plot as <plot name>.tmp, when a connection drops the sender reconnects and resumes
+        from the amount of data already received
+    4 - at the end both sides compare the SHA-256 of the plot, only then the receiver renames the plot and the
+        sender deletes its local copy
+
+HOW TO USE THE SCRIPT:
+    1 - on the harvester configure RECEIVER_DRIVES, RECEIVER_HOST (the address of the harvester on the local network)
+        and RECEIVER_PORT, then run the script
+    2 - on the plotting machine configure REMOTE_HARVESTERS (for example ["192.168.1.10:8450"])
+    3 - to try it on a single machine run the receiver with RECEIVER_DRIVES set to a local folder and use
+        REMOTE_HARVESTERS = ["127.0.0.1:8450"]
+
+NOTE: the receiver does not authenticate the senders, bind it only to a trusted network. it accepts only plot files
+(plot-k<N>-<...>.plot) and never overwrites a plot already on its drives.
+"""
+
+import os, sys, re, json, time, datetime
+import socket, socketserver, threading, queue, hashlib
+import psutil
+from chia_plotter_transfer import drop_file_cache
+
+# configuration constants for the harvester (receiver)
+RECEIVER_DRIVES = ["D:/"]  # example ["E:/", "F:/", "G:/", "H:/", "I:/"]
+RECEIVER_HOST = "127.0.0.1"  # example "192.168.1.10"
+RECEIVER_PORT = 8450
+
+# configuration constants for the plotting machine (sender). an empty list keeps the plots on the local drives
+REMOTE_HARVESTERS = []  # example ["192.168.1.10:8450", "192.168.1.11:8450"]
+
+# constants - only advanced users should change them
+TRANSFER_SOCKET_BUFFER = 16 * 2 ** 20
+TRANSFER_CHUNK_SIZE = 8 * 2 ** 20
+# the retries last longer than TRANSFER_TIMEOUT, so the receiver releases a dead stream before the sender gives up
+TRANSFER_RETRIES = 20
+TRANSFER_RETRY_INTERVAL = 30
+TRANSFER_TIMEOUT = 300
+PLOT_NAME_PATTERN = re.compile(r"plot-k\d+-.*\.plot")
+
+
+def print_debug(data=None):
+    if data != None:
+        print("[%s]\t" % (datetime.datetime.now()) + data)
+    else:
+        print()
+
+
+def hash_file_prefix(file_path, length, chunk_size=TRANSFER_CHUNK_SIZE):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while length > 0:
+            data = f.read(min(chunk_size, length))
+            if not data:
+                break
+            sha256.update(data)
+            length -= len(data)
+    return sha256
+
+
+def receive_json(rfile):
+    line = rfile.readline()
+    if not line:
+        raise ConnectionError("connection closed")
+    return json.loads(line)
+
+
+def send_json(wfile, data):
+    wfile.write((json.dumps(data) + "\n").encode())
+    wfile.flush()
+
+
+# receiver
+
+
+class PlotReceiverHandler(socketserver.StreamRequestHandler):
+    # a dead stream times out, so the plot is released and the sender can resume it
+    timeout = TRANSFER_TIMEOUT
+
+    def handle(self):
+        try:
+            request = receive_json(self.rfile)
+            if request["command"] == "capabilities":
+                send_json(self.wfile, {"drives": self.server.retrieve_drives()})
+            elif request["command"] == "send":
+                self.receive_plot(request["name"], request["size"])
+        except (OSError, ValueError, KeyError) as e:
+            print_debug(
+                "\tError handling request from %s: %s" % (self.client_address[0], e)
+            )
+
+    def receive_plot(self, plot_name, plot_size):
+        if (
+            os.path.basename(plot_name) != plot_name
+            or PLOT_NAME_PATTERN.fullmatch(plot_name) == None
+        ):
+            send_json(self.wfile, {"error": "not a plot file", "refused": True})
+            print_debug(
+                "\tRefused file %s from %s" % (plot_name, self.client_address[0])
+            )
+            return
+        if self.server.find_plot(plot_name) != None:
+            send_json(self.wfile, {"error": "plot already received", "refused": True})
+            return
+        with self.server.lock:
+            if plot_name in self.server.active_plots:
+                send_json(self.wfile, {"error": "plot already being received"})
+                return
+            self.server.active_plots.add(plot_name)
+        try:
+            storage_drive = self.server.select_drive(plot_name, plot_size)
+            if storage_drive == None:
+                send_json(self.wfile, {"error": "no space left for the plot"})
+                return
+            partial_path = os.path.join(storage_drive, plot_name + ".tmp")
+            offset = (
+                os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+            )
+            offset = min(offset, plot_size)
+            sha256 = (
+                hash_file_prefix(partial_path, offset)
+                if offset > 0
+                else hashlib.sha256()
+            )
+            send_json(self.wfile, {"offset": offset})
+            print_debug(
+                "Receiving plot %s into %s from offset %.2f GiB"
+                % (plot_name, storage_drive, offset / 2 ** 30)
+            )
+
+            with open(partial_path, "r+b" if offset > 0 else "wb") as f:
+                f.seek(offset)
+                f.truncate()
+                remaining = plot_size - offset
+                while remaining > 0:
+                    data = self.rfile.read(min(TRANSFER_CHUNK_SIZE, remaining))
+                    if not data:
+                        raise ConnectionError(
+                            "connection closed after %d bytes" % (plot_size - remaining)
+                        )
+                    f.write(data)
+                    sha256.update(data)
+                    remaining -= len(data)
+
+            request = receive_json(self.rfile)
+            if request.get("sha256") != sha256.hexdigest():
+                os.remove(partial_path)
+                send_json(self.wfile, {"error": "checksum mismatch"})
+                print_debug(
+                    "\tChecksum mismatch for plot %s, partial plot deleted" % plot_name
+                )
+                return
+            if self.server.find_plot(plot_name) != None:
+                os.remove(partial_path)
+                send_json(
+                    self.wfile, {"error": "plot already received", "refused": True}
+                )
+                return
+            os.replace(partial_path, os.path.join(storage_drive, plot_name))
+            send_json(self.wfile, {"status": "ok"})
+            print_debug("\tplot %s received" % plot_name)
+        finally:
+            with self.server.lock:
+                self.server.active_plots.discard(plot_name)
+
+
+class PlotReceiver(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, receiver_drives):
+        self.receiver_drives = receiver_drives
+        self.lock = threading.Lock()
+        self.active_plots = set()
+        socketserver.ThreadingTCPServer.__init__(self, address, PlotReceiverHandler)
+
+    def server_bind(self):
+        # accepted sockets inherit the receive window
+        self.socket.setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, TRANSFER_SOCKET_BUFFER
+        )
+        socketserver.ThreadingTCPServer.server_bind(self)
+
+    def retrieve_drives(self):
+        drives = []
+        for receiver_drive in self.receiver_drives:
+            try:
+                drives.append(
+                    {
+                        "storage_drive": receiver_drive,
+                        "drive_available_space_gib": psutil.disk_usage(
+                            receiver_drive
+                        ).free
+                        / (2 ** 30),
+                    }
+                )
+            except OSError:
+                print_debug("\tError processing storage drive %s" % receiver_drive)
+        return drives
+
+    def find_plot(self, plot_name):
+        for receiver_drive in self.receiver_drives:
+            if os.path.exists(os.path.join(receiver_drive, plot_name)):
+                return receiver_drive
+        return None
+
+    def select_drive(self, plot_name, plot_size):
+        # resume on the drive holding the partial plot, otherwise the drive with the most free space
+        for receiver_drive in self.receiver_drives:
+            if os.path.exists(os.path.join(receiver_drive, plot_name + ".tmp")):
+                return receiver_drive
+        drives = sorted(
+            self.retrieve_drives(),
+            key=lambda x: x["drive_available_space_gib"],
+            reverse=True,
+        )
+        if (
+            len(drives) > 0
+            and drives[0]["drive_available_space_gib"] * 2 ** 30 > plot_size
+        ):
+            return drives[0]["storage_drive"]
+        return None
+
+
+def start_receiver(
+    receiver_drives=RECEIVER_DRIVES,
+    receiver_port=RECEIVER_PORT,
+    receiver_host=RECEIVER_HOST,
+):
+    plot_receiver = PlotReceiver((receiver_host, receiver_port), receiver_drives)
+    threading.Thread(target=plot_receiver.serve_forever, daemon=True).start()
+    return plot_receiver
+
+
+# sender
+
+
+def connect_to_harvester(remote_harvester, transfer_timeout=TRANSFER_TIMEOUT):
+    host, port = remote_harvester.rsplit(":", 1)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, TRANSFER_SOCKET_BUFFER)
+    sock.settimeout(transfer_timeout)
+    sock.connect((host, int(port)))
+    return sock
+
+
+def retrieve_harvester_capabilities(remote_harvester):
+    with connect_to_harvester(remote_harvester) as sock:
+        with sock.makefile("rwb") as f:
+            send_json(f, {"command": "capabilities"})
+            drives = receive_json(f)["drives"]
+    return {
+        "remote_harvester": remote_harvester,
+        "drives": drives,
+        "max_drive_available_space_gib": max(
+            [0] + [x["drive_available_space_gib"] for x in drives]
+        ),
+    }
+
+
+def send_plot_attempt(plot_path, remote_harvester, chunk_size=TRANSFER_CHUNK_SIZE):
+    plot_size = os.path.getsize(plot_path)
+    with connect_to_harvester(remote_harvester) as sock:
+        with sock.makefile("rwb") as f:
+            send_json(
+                f,
+                {
+                    "command": "send",
+                    "name": os.path.basename(plot_path),
+                    "size": plot_size,
+                },
+            )
+            response = receive_json(f)
+            if response.get("refused"):
+                # the receiver will never take this plot, no point in retrying
+                print_debug(
+                    "\tPlot %s refused by %s: %s"
+                    % (plot_path, remote_harvester, response["error"])
+                )
+                return None
+            if "error" in response:
+                raise ValueError(response["error"])
+            offset = response["offset"]
+            sha256 = hash_file_prefix(plot_path, offset)
+            with open(plot_path, "rb") as plot_file:
+                plot_file.seek(offset)
+                dropped_offset = offset
+                while True:
+                    data = plot_file.read(chunk_size)
+                    if not data:
+                        break
+                    sha256.update(data)
+                    f.write(data)
+                    # the plot is read once, keep it out of the page cache
+                    drop_file_cache(
+                        plot_file.fileno(),
+                        dropped_offset,
+                        plot_file.tell() - dropped_offset,
+                    )
+                    dropped_offset = plot_file.tell()
+            send_json(f, {"sha256": sha256.hexdigest()})
+            response = receive_json(f)
+            if response.get("refused"):
+                print_debug(
+                    "\tPlot %s refused by %s: %s"
+                    % (plot_path, remote_harvester, response["error"])
+                )
+                return None
+            if "error" in response:
+                raise ValueError(response["error"])
+    return offset
+
+
+def send_plot(
+    plot_path,
+    remote_harvester,
+    transfer_retries=TRANSFER_RETRIES,
+    transfer_retry_interval=TRANSFER_RETRY_INTERVAL,
+):
+    plot_size = os.path.getsize(plot_path)
+    for attempt in range(transfer_retries):
+        try:
+            start_time = time.time()
+            offset = send_plot_attempt(plot_path, remote_harvester)
+            if offset == None:
+                return False
+            elapsed_time = max(time.time() - start_time, 1e-6)
+            print_debug(
+                "Plot %s sent to %s (%.2f MiB/s)"
+                % (
+                    plot_path,
+                    remote_harvester,
+                    (plot_size - offset) / 2 ** 20 / elapsed_time,
+                )
+            )
+            os.remove(plot_path)
+            return True
+        except (OSError, ValueError) as e:
+            print_debug(
+                "\tError sending plot %s to %s: %s, retrying in %d seconds"
+                % (plot_path, remote_harvester, e, transfer_retry_interval)
+            )
+            time.sleep(transfer_retry_interval)
+    return False
+
+
+def send_plots(plot_paths, remote_harvesters=REMOTE_HARVESTERS):
+    # one stream for each harvester, every stream takes the next plot as soon as it is free
+    plots_queue = queue.Queue()
+    for plot_path in plot_paths:
+        plots_queue.put(plot_path)
+    sent_plots = []
+
+    def harvester_worker(remote_harvester):
+        while True:
+            try:
+                plot_path = plots_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                harvester_capabilities = retrieve_harvester_capabilities(
+                    remote_harvester
+                )
+            except (OSError, ValueError) as e:
+                print_debug("\tHarvester %s unreachable: %s" % (remote_harvester, e))
+                plots_queue.put(plot_path)
+                return
+            if harvester_capabilities[
+                "max_drive_available_space_gib"
+            ] * 2 ** 30 <= os.path.getsize(plot_path):
+                print_debug("\tHarvester %s has no space left" % remote_harvester)
+                plots_queue.put(plot_path)
+                return
+            print_debug("Sending plot %s to %s" % (plot_path, remote_harvester))
+            if send_plot(plot_path, remote_harvester):
+                sent_plots.append(plot_path)
+
+    harvester_threads = [
+        threading.Thread(target=harvester_worker, args=(remote_harvester,))
+        for remote_harvester in remote_harvesters
+    ]
+    for harvester_thread in harvester_threads:
+        harvester_thread.start()
+    for harvester_thread in harvester_threads:
+        harvester_thread.join()
+
+    return sent_plots
+
+
+if __name__ == "__main__":
+    plot_receiver = start_receiver()
+    print_debug(
+        "Receiving plots on %s:%d into %s"
+        % (RECEIVER_HOST, RECEIVER_PORT, ", ".join(RECEIVER_DRIVES))
+    )
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        plot_receiver.shutdown()
@@ -0,0 +1,87 @@
+"""
+This python module plans how many plots of each k size fit into a storage drive.
+
+With a single plot size up to one plot of space (about 100 GiB for k32) is left empty on every drive. Mixing k32,
+k33 and k34 plots fills the drives better: for each drive every combination of plot sizes is evaluated and the one
+with the largest amount of plotted bytes is kept. Combinations within PACKING_TOLERANCE_GIB of the best one are
+considered equal, among them the one with the fewest bigger plots wins, since they are slower to make and need
+more temporary space.
+
+Plot sizes (GiB):
+    k32: temporary 239, final 101.3
+    k33: temporary 521, final 208.8
+    k34: temporary 1041, final 429.8
+"""
+
+# constants - only advanced users should change them
+PLANNED_K_FACTORS = [32, 33, 34]
+PLOT_SIZES_GIB = {
+    32: {"temp": 239, "final": 101.3},
+    33: {"temp": 521, "final": 208.8},
+    34: {"temp": 1041, "final": 429.8},
+}
+PACKING_TOLERANCE_GIB = 10
+JOB_SEPARATOR = " & "
+
+
+def plan_storage_drive_plots(
+    available_space_gib,
+    plot_final_sizes_gib,
+    packing_tolerance_gib=PACKING_TOLERANCE_GIB,
+):
+    # plot_final_sizes_gib: {k_factor: final size}, returns {k_factor: number of plots}
+    k_factors = sorted(plot_final_sizes_gib, reverse=True)
+    if len(k_factors) == 0:
+        return {}
+    plans = []
+
+    def evaluate(index, remaining_space_gib, plots):
+        k_factor = k_factors[index]
+        plot_final_size_gib = plot_final_sizes_gib[k_factor]
+        max_plots = max(int(remaining_space_gib / plot_final_size_gib), 0)
+        if index == len(k_factors) - 1:
+            plots[k_factor] = max_plots
+            plans.append(
+                (
+                    available_space_gib
+                    - remaining_space_gib
+                    + max_plots * plot_final_size_gib,
+                    dict(plots),
+                )
+            )
+            return
+        for number_of_plots in range(max_plots + 1):
+            plots[k_factor] = number_of_plots
+            evaluate(
+                index + 1,
+                remaining_space_gib - number_of_plots * plot_final_size_gib,
+                plots,
+            )
+
+    evaluate(0, available_space_gib, {})
+
+    max_used_space_gib = max(plan[0] for plan in plans)
+    return min(
+        (
+            plan
+            for plan in plans
+            if plan[0] >= max_used_space_gib - packing_tolerance_gib
+        ),
+        key=lambda plan: (
+            sum(plan[1][k_factor] for k_factor in k_factors[:-1]),
+            -plan[0],
+        ),
+    )[1]
+
+
+def plannable_k_factors(
+    available_temp_space_gib,
+    k_factors=PLANNED_K_FACTORS,
+    plot_sizes_gib=PLOT_SIZES_GIB,
+):
+    # only the k sizes whose temporary files fit into the plotting space can be planned
+    return [
+        k_factor
+        for k_factor in k_factors
+        if plot_sizes_gib[k_factor]["temp"] <= available_temp_space_gib
+    ]
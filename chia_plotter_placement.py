@@ -0,0 +1,215 @@
+"""
+This python module chooses the temporary plotting drive of a new plotting process when the process is launched.
+
+It works as follows:
+    1 - sample the I/O counters of the plotting drives for IO_SAMPLING_SECONDS
+    2 - compute the utilisation (busy time) and the average queue depth (time spent by the requests in the device
+        queue over the interval) of each drive
+    3 - estimate the load of the next hour from the phases of the processes already plotting on each drive
+        (PHASE_IO_LOADS, a process in phase 1 keeps loading its drive for hours, one in phase 4 is almost done)
+    4 - the new process goes to the drive with free temporary space and the lowest load
+
+The disk of each plotting drive is resolved from its partition: on Windows the volume is mapped to its
+PhysicalDriveN, on Linux symlinks (e.g. /dev/mapper/<name> or /dev/disk/by-uuid/<uuid>) are resolved to the kernel
+device (e.g. dm-0). When the disk of a plotting drive cannot be found a message is printed and only the phases of
+the processes are taken into account for that drive.
+"""
+
+import sys, os, glob, struct, time, datetime
+import psutil
+from chia_plotter_priority import find_plotting_processes, detect_plotting_phase
+
+# constants - only advanced users should change them
+LOAD_AWARE_PLACEMENT = True
+IO_SAMPLING_SECONDS = 5
+QUEUE_DEPTH_WEIGHT = 0.25
+PHASE_IO_LOADS = {1: 1.0, 2: 0.6, 3: 0.8, 4: 0.3}
+IOCTL_VOLUME_GET_VOLUME_DISK_EXTENTS = 0x00560000
+
+unmapped_plotting_drives = set()
+
+
+def print_debug(data=None):
+    if data != None:
+        print("[%s]\t" % (datetime.datetime.now()) + data)
+    else:
+        print()
+
+
+def find_windows_physical_drive(mountpoint):
+    import ctypes
+    from ctypes import wintypes
+
+    kernel32 = ctypes.windll.kernel32
+    kernel32.CreateFileW.restype = wintypes.HANDLE
+    # e.g. \\.\C: for the C:\ volume, no access rights are needed to query its extents
+    volume = "\\\\.\\" + mountpoint.rstrip("\\/")
+    # FILE_SHARE_READ | FILE_SHARE_WRITE, OPEN_EXISTING
+    handle = kernel32.CreateFileW(volume, 0, 0x1 | 0x2, None, 3, 0, None)
+    if handle == None or handle == wintypes.HANDLE(-1).value:
+        return None
+    try:
+        # VOLUME_DISK_EXTENTS: number of extents, then the DISK_EXTENT of each one (8 bytes aligned)
+        volume_disk_extents = ctypes.create_string_buffer(1024)
+        returned_size = wintypes.DWORD()
+        if not kernel32.DeviceIoControl(
+            wintypes.HANDLE(handle),
+            IOCTL_VOLUME_GET_VOLUME_DISK_EXTENTS,
+            None,
+            0,
+            volume_disk_extents,
+            ctypes.sizeof(volume_disk_extents),
+            ctypes.byref(returned_size),
+            None,
+        ):
+            return None
+        number_of_extents, disk_number = struct.unpack_from(
+            "<I4xI", volume_disk_extents.raw
+        )
+        if number_of_extents == 0:
+            return None
+        return "PhysicalDrive%d" % disk_number
+    finally:
+        kernel32.CloseHandle(wintypes.HANDLE(handle))
+
+
+def find_linux_disk_name(device, disk_names):
+    # e.g. /dev/mapper/<name> and /dev/disk/by-uuid/<uuid> are symlinks to the kernel device
+    disk_name = os.path.basename(os.path.realpath(device))
+    if disk_name in disk_names:
+        return disk_name
+    for dm_name_path in glob.glob("/sys/class/block/*/dm/name"):
+        try:
+            with open(dm_name_path) as f:
+                dm_name = f.read().strip()
+        except OSError:
+            continue
+        disk_name = dm_name_path.split("/")[-3]
+        if dm_name == os.path.basename(device) and disk_name in disk_names:
+            return disk_name
+    return None
+
+
+def find_drive_disk_name(plotting_drive, disk_names):
+    # the partition with the longest mountpoint containing the drive
+    plotting_drive = os.path.normcase(os.path.abspath(plotting_drive))
+    best_partition = None
+    for partition in psutil.disk_partitions():
+        mountpoint = os.path.normcase(os.path.normpath(partition.mountpoint))
+        try:
+            # path components, /mnt/ssd10 is not inside /mnt/ssd1
+            inside_mountpoint = (
+                os.path.commonpath([plotting_drive, mountpoint]) == mountpoint
+            )
+        except ValueError:
+            # e.g. different drive letters on Windows
+            inside_mountpoint = False
+        if inside_mountpoint and (
+            best_partition == None or len(mountpoint) > len(best_partition.mountpoint)
+        ):
+            best_partition = partition
+    if best_partition == None:
+        return None
+
+    if sys.platform == "win32":
+        try:
+            disk_name = find_windows_physical_drive(best_partition.mountpoint)
+        except (OSError, AttributeError):
+            disk_name = None
+        return disk_name if disk_name in disk_names else None
+    if sys.platform.startswith("linux"):
+        return find_linux_disk_name(best_partition.device, disk_names)
+    disk_name = os.path.basename(best_partition.device)
+    return disk_name if disk_name in disk_names else None
+
+
+def sample_disks_io(io_sampling_seconds=IO_SAMPLING_SECONDS):
+    start_counters = psutil.disk_io_counters(perdisk=True) or {}
+    start_time = time.time()
+    time.sleep(io_sampling_seconds)
+    end_counters = psutil.disk_io_counters(perdisk=True) or {}
+    interval_ms = (time.time() - start_time) * 1000
+
+    disks_io = {}
+    for disk_name, end_counter in end_counters.items():
+        if disk_name not in start_counters:
+            continue
+        start_counter = start_counters[disk_name]
+        requests_time = (end_counter.read_time + end_counter.write_time) - (
+            start_counter.read_time + start_counter.write_time
+        )
+        if hasattr(end_counter, "busy_time"):
+            busy_time = end_counter.busy_time - start_counter.busy_time
+        else:
+            busy_time = requests_time
+        disks_io[disk_name] = {
+            "utilisation": min(busy_time / interval_ms, 1.0),
+            "queue_depth": requests_time / interval_ms,
+        }
+    return disks_io
+
+
+def retrieve_plotting_drives_load(
+    plotting_drives, plotting_jobs, phase_io_loads=PHASE_IO_LOADS
+):
+    # plotting_jobs: list of (plotting drive, temporary folder) of the processes already launched
+    disks_io = sample_disks_io()
+    plotting_drives_load = {}
+    for plotting_drive in plotting_drives:
+        disk_name = find_drive_disk_name(plotting_drive, disks_io)
+        if disk_name == None and plotting_drive not in unmapped_plotting_drives:
+            unmapped_plotting_drives.add(plotting_drive)
+            print_debug(
+                "Unable to find the disk of plotting drive %s, its live I/O load is ignored"
+                % plotting_drive
+            )
+        disk_io = disks_io.get(disk_name, {"utilisation": 0, "queue_depth": 0})
+        jobs_load = 0
+        for job_plotting_drive, temp_folder in plotting_jobs:
+            if job_plotting_drive != plotting_drive:
+                continue
+            for plotting_process in find_plotting_processes(temp_folder):
+                jobs_load += phase_io_loads[
+                    detect_plotting_phase(plotting_process, temp_folder)
+                ]
+        plotting_drives_load[plotting_drive] = {
+            "utilisation": disk_io["utilisation"],
+            "queue_depth": disk_io["queue_depth"],
+            "jobs_load": jobs_load,
+            "load": disk_io["utilisation"]
+            + QUEUE_DEPTH_WEIGHT * disk_io["queue_depth"]
+            + jobs_load,
+        }
+    return plotting_drives_load
+
+
+def select_plotting_drive(plotting_drives_temp_slots, plotting_jobs):
+    # plotting_drives_temp_slots: {plotting drive: free temporary slots}
+    candidate_drives = [
+        plotting_drive
+        for plotting_drive, temp_slots in plotting_drives_temp_slots.items()
+        if temp_slots > 0
+    ]
+    if len(candidate_drives) <= 1:
+        return candidate_drives[0] if len(candidate_drives) == 1 else None
+
+    plotting_drives_load = retrieve_plotting_drives_load(
+        candidate_drives, plotting_jobs
+    )
+    for plotting_drive in candidate_drives:
+        print_debug(
+            "Plotting drive %s: utilisation %.0f%%, queue depth %.2f, load of the running processes %.2f"
+            % (
+                plotting_drive,
+                plotting_drives_load[plotting_drive]["utilisation"] * 100,
+                plotting_drives_load[plotting_drive]["queue_depth"],
+                plotting_drives_load[plotting_drive]["jobs_load"],
+            )
+        )
+    return min(
+        candidate_drives,
+        key=lambda x: (
+            plotting_drives_load[x]["load"],
+            -plotting_drives_temp_slots[x],
+        ),
+    )
@@ -0,0 +1,242 @@
+"""
+This python module manages the CPU and I/O priorities of the processes launched by the plotting scripts.
+
+It works as follows:
+    1 - find the plotting processes through their temporary folder (it is part of their command line)
+    2 - detect the plotting phase of each process from the temporary files it is working on
+    3 - apply the CPU and I/O priority configured for that phase (PHASE_PRIORITIES)
+    4 - transfers and cleanups run in a child process with TRANSFER_PRIORITIES, so they do not compete with the
+        plotters and the scripts (and the plotters they launch) keep their own priority
+
+Priorities are expressed as levels ("normal", "low", "idle") and translated for each operating system:
+    - Linux with cgroup v2: each level combination is a cgroup with its own cpu.weight and io.weight
+    - Linux without cgroup v2: nice and ionice (best-effort or idle class) of every thread of the process
+    - Windows: priority classes and I/O priorities
+
+NOTE: on Linux a non root user can lower the priority of a process but cannot raise it again with nice. cgroup
+weights do not have this limitation, but the cgroup hierarchy must be writable by the user running the scripts.
+without cgroups and without root (or CAP_SYS_NICE) only the I/O priorities of the plotting phases are applied.
+"""
+
+import sys, os, re, datetime
+import multiprocessing
+import psutil
+
+# constants - only advanced users should change them
+MANAGE_PRIORITIES = True
+PRIORITY_CHECKING_INTERVAL = 60
+CGROUP_ROOT = "/sys/fs/cgroup"
+CGROUP_NAME = "chia_plotter"
+# (cpu level, io level) for each plotting phase. phase 1 is CPU bound, phases 2-4 are mostly I/O bound
+PHASE_PRIORITIES = {
+    1: ("normal", "normal"),
+    2: ("low", "normal"),
+    3: ("low", "normal"),
+    4: ("low", "low"),
+}
+TRANSFER_PRIORITIES = ("idle", "idle")
+CGROUP_WEIGHTS = {"normal": 100, "low": 50, "idle": 1}
+
+if sys.platform == "win32":
+    CPU_PRIORITY_LEVELS = {
+        "normal": psutil.NORMAL_PRIORITY_CLASS,
+        "low": psutil.BELOW_NORMAL_PRIORITY_CLASS,
+        "idle": psutil.IDLE_PRIORITY_CLASS,
+    }
+    IO_PRIORITY_LEVELS = {
+        "normal": (psutil.IOPRIO_NORMAL,),
+        "low": (psutil.IOPRIO_LOW,),
+        "idle": (psutil.IOPRIO_VERYLOW,),
+    }
+elif sys.platform.startswith("linux"):
+    CPU_PRIORITY_LEVELS = {"normal": 0, "low": 10, "idle": 19}
+    IO_PRIORITY_LEVELS = {
+        "normal": (psutil.IOPRIO_CLASS_BE, 4),
+        "low": (psutil.IOPRIO_CLASS_BE, 7),
+        "idle": (psutil.IOPRIO_CLASS_IDLE,),
+    }
+else:
+    CPU_PRIORITY_LEVELS = {"normal": 0, "low": 10, "idle": 19}
+    IO_PRIORITY_LEVELS = {}
+
+# temporary files carry the phase in their name, e.g. plot-k32-[...].plot.p3s.t5.sort_bucket_042.tmp
+PHASE_FILE_PATTERN = re.compile(r"\.p([1-4])s?\.")
+
+cgroup_availability = None
+cpu_priority_raising = None
+
+
+def print_debug(data=None):
+    if data != None:
+        print("[%s]\t" % (datetime.datetime.now()) + data)
+    else:
+        print()
+
+
+def is_cgroup_available(cgroup_root=CGROUP_ROOT, cgroup_name=CGROUP_NAME):
+    global cgroup_availability
+
+    if cgroup_availability is None:
+        cgroup_availability = False
+        try:
+            with open(os.path.join(cgroup_root, "cgroup.controllers")) as f:
+                controllers = f.read().split()
+            if "cpu" in controllers and "io" in controllers:
+                with open(
+                    os.path.join(cgroup_root, "cgroup.subtree_control"), "w"
+                ) as f:
+                    f.write("+cpu +io")
+                cgroup_directory = os.path.join(cgroup_root, cgroup_name)
+                os.makedirs(cgroup_directory, exist_ok=True)
+                with open(
+                    os.path.join(cgroup_directory, "cgroup.subtree_control"), "w"
+                ) as f:
+                    f.write("+cpu +io")
+                cgroup_availability = True
+        except OSError:
+            pass
+
+    return cgroup_availability
+
+
+def can_raise_cpu_priority():
+    global cpu_priority_raising
+
+    if cpu_priority_raising is None:
+        if sys.platform == "win32" or os.geteuid() == 0:
+            cpu_priority_raising = True
+        else:
+            cpu_priority_raising = False
+            # CAP_SYS_NICE is the bit 23 of the effective capabilities
+            try:
+                with open("/proc/self/status") as f:
+                    for line in f:
+                        if line.startswith("CapEff:"):
+                            cpu_priority_raising = (
+                                int(line.split()[1], 16) & (1 << 23) != 0
+                            )
+            except OSError:
+                pass
+
+    return cpu_priority_raising
+
+
+def set_cgroup_priority(
+    pid, cpu_level, io_level, cgroup_root=CGROUP_ROOT, cgroup_name=CGROUP_NAME
+):
+    cgroup_directory = os.path.join(
+        cgroup_root, cgroup_name, "cpu_%s_io_%s" % (cpu_level, io_level)
+    )
+    if not os.path.exists(cgroup_directory):
+        os.makedirs(cgroup_directory)
+        with open(os.path.join(cgroup_directory, "cpu.weight"), "w") as f:
+            f.write("%d" % CGROUP_WEIGHTS[cpu_level])
+        with open(os.path.join(cgroup_directory, "io.weight"), "w") as f:
+            f.write("default %d" % CGROUP_WEIGHTS[io_level])
+    with open(os.path.join(cgroup_directory, "cgroup.procs"), "w") as f:
+        f.write("%d" % pid)
+
+
+def set_process_priority(pid, cpu_level, io_level):
+    try:
+        if is_cgroup_available():
+            set_cgroup_priority(pid, cpu_level, io_level)
+            return True
+    except OSError:
+        print_debug("\tUnable to move process %d into its cgroup" % pid)
+
+    try:
+        process = psutil.Process(pid)
+        if sys.platform.startswith("linux"):
+            # on Linux nice and ionice apply to a single thread, the plotters work in their other threads
+            for thread in process.threads():
+                try:
+                    os.setpriority(
+                        os.PRIO_PROCESS, thread.id, CPU_PRIORITY_LEVELS[cpu_level]
+                    )
+                    psutil.Process(thread.id).ionice(*IO_PRIORITY_LEVELS[io_level])
+                except (psutil.NoSuchProcess, ProcessLookupError):
+                    pass
+            return True
+        process.nice(CPU_PRIORITY_LEVELS[cpu_level])
+        if io_level in IO_PRIORITY_LEVELS and hasattr(process, "ionice"):
+            process.ionice(*IO_PRIORITY_LEVELS[io_level])
+        return True
+    except (psutil.Error, OSError):
+        print_debug(
+            "\tUnable to set priority cpu %s io %s for process %d"
+            % (cpu_level, io_level, pid)
+        )
+        return False
+
+
+def set_background_priority(transfer_priorities=TRANSFER_PRIORITIES):
+    set_process_priority(os.getpid(), *transfer_priorities)
+
+
+def run_with_background_priority(function, *args):
+    # used for moves and cleanups. they run in a child process, since an unprivileged user cannot raise the priority
+    # of the scripts again once lowered, and the plotters launched afterwards would inherit it
+    with multiprocessing.Pool(1, initializer=set_background_priority) as pool:
+        return pool.apply(function, args)
+
+
+def find_plotting_processes(temp_folder):
+    plotting_processes = []
+    for process in psutil.process_iter(["cmdline"]):
+        cmdline = process.info["cmdline"] or []
+        if any(
+            os.path.normpath(arg) == os.path.normpath(temp_folder) for arg in cmdline
+        ):
+            plotting_processes.append(process)
+    return plotting_processes
+
+
+def detect_plotting_phase(plotting_process, temp_folder):
+    phases = []
+    try:
+        for open_file in plotting_process.open_files():
+            match = PHASE_FILE_PATTERN.search(os.path.basename(open_file.path))
+            if match:
+                phases.append(int(match.group(1)))
+    except psutil.Error:
+        pass
+    if len(phases) > 0:
+        return max(phases)
+
+    # fallback on the most recent temporary file
+    try:
+        temp_files = sorted(
+            os.scandir(temp_folder), key=lambda x: x.stat().st_mtime, reverse=True
+        )
+    except OSError:
+        return 1
+    for temp_file in temp_files:
+        match = PHASE_FILE_PATTERN.search(temp_file.name)
+        if match:
+            return int(match.group(1))
+    return 1
+
+
+def update_plotting_priorities(
+    temp_folders, plotting_phases, phase_priorities=PHASE_PRIORITIES
+):
+    running_processes = 0
+    for temp_folder in temp_folders:
+        for plotting_process in find_plotting_processes(temp_folder):
+            running_processes += 1
+            phase = detect_plotting_phase(plotting_process, temp_folder)
+            cpu_level, io_level = phase_priorities[phase]
+            if not is_cgroup_available() and not can_raise_cpu_priority():
+                # the CPU priority could not be raised again for the phase 1 of the next plot
+                cpu_level = "normal"
+            if plotting_phases.get(plotting_process.pid) != phase:
+                print_debug(
+                    "Process %d (%s) is in phase %d, setting priority cpu %s io %s"
+                    % (plotting_process.pid, temp_folder, phase, cpu_level, io_level)
+                )
+                # a failed change is retried at the next check
+                if set_process_priority(plotting_process.pid, cpu_level, io_level):
+                    plotting_phases[plotting_process.pid] = phase
+
+    return running_processes
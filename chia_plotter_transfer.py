@@ -0,0 +1,221 @@
+"""
+This python script moves the finished plots without filling the page cache.
+
+A plain shutil.move of a 100 GiB plot goes through the page cache and evicts the data the running plotter needs
+(e.g. the madmax temp2 files or the cached bucket files), so phase times degrade during every move.
+
+Transfer modes (TRANSFER_MODE):
+    - "buffered": shutil.move, as before
+    - "fadvise": regular reads and writes, every TRANSFER_SYNC_SIZE bytes the written data is flushed and both the
+      read and the written pages are dropped with posix_fadvise(DONTNEED), the cache footprint stays at a few MiB
+    - "direct": O_DIRECT reads and writes with aligned buffers, the page cache is not used at all
+On systems without posix_fadvise or O_DIRECT (e.g. Windows) the transfer falls back to the buffered mode.
+
+The plot is written as <plot name>.tmp and renamed at the end, so an interrupted move leaves a partial plot that the
+plot inventory can reclaim.
+
+HOW TO MEASURE THE MODES:
+    python chia_plotter_transfer.py <plot file> <destination folder>
+    each mode copies the plot, the throughput and the page cache growth are reported, the copies are deleted
+"""
+
+import os, sys, time, datetime
+import shutil, mmap, threading
+import psutil
+
+# constants - only advanced users should change them
+TRANSFER_MODE = "fadvise"
+TRANSFER_CHUNK_SIZE = 4 * 2 ** 20
+TRANSFER_SYNC_SIZE = 16 * 2 ** 20
+TRANSFER_MODES = ["buffered", "fadvise", "direct"]
+
+
+def print_debug(data=None):
+    if data != None:
+        print("[%s]\t" % (datetime.datetime.now()) + data)
+    else:
+        print()
+
+
+def drop_file_cache(fd, offset=0, length=0):
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+
+
+def copy_file_fadvise(
+    source, destination, chunk_size=TRANSFER_CHUNK_SIZE, sync_size=TRANSFER_SYNC_SIZE
+):
+    source_fd = os.open(source, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        destination_fd = os.open(
+            destination,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0),
+        )
+        try:
+            os.posix_fadvise(source_fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            offset = 0
+            synced_offset = 0
+            while True:
+                data = os.read(source_fd, chunk_size)
+                if not data:
+                    break
+                os.write(destination_fd, data)
+                offset += len(data)
+                if offset - synced_offset >= sync_size:
+                    # dirty pages cannot be dropped, they are written first
+                    os.fdatasync(destination_fd)
+                    drop_file_cache(
+                        destination_fd, synced_offset, offset - synced_offset
+                    )
+                    drop_file_cache(source_fd, synced_offset, offset - synced_offset)
+                    synced_offset = offset
+            os.fdatasync(destination_fd)
+            drop_file_cache(destination_fd)
+            drop_file_cache(source_fd)
+        finally:
+            os.close(destination_fd)
+    finally:
+        os.close(source_fd)
+
+
+def copy_file_direct(source, destination, chunk_size=TRANSFER_CHUNK_SIZE):
+    source_size = os.path.getsize(source)
+    # anonymous mmaps are page aligned, as O_DIRECT requires
+    buffer = mmap.mmap(-1, chunk_size)
+    source_fd = os.open(source, os.O_RDONLY | os.O_DIRECT)
+    try:
+        destination_fd = os.open(
+            destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_DIRECT
+        )
+        try:
+            copied_size = 0
+            while True:
+                read_size = os.readv(source_fd, [buffer])
+                if read_size == 0:
+                    break
+                if copied_size % mmap.PAGESIZE != 0:
+                    # only the last block can be unaligned, the data after it would be misplaced
+                    raise OSError(
+                        "short read at %d bytes of %s" % (copied_size, source)
+                    )
+                # the last block is padded to the alignment and truncated afterwards
+                aligned_size = -(-read_size // mmap.PAGESIZE) * mmap.PAGESIZE
+                os.write(destination_fd, memoryview(buffer)[:aligned_size])
+                copied_size += read_size
+            if copied_size != source_size:
+                raise OSError(
+                    "copied %d bytes of %d from %s" % (copied_size, source_size, source)
+                )
+            os.ftruncate(destination_fd, source_size)
+            os.fsync(destination_fd)
+        finally:
+            os.close(destination_fd)
+    finally:
+        os.close(source_fd)
+        buffer.close()
+
+
+def copy_plot(source, destination, transfer_mode=TRANSFER_MODE):
+    if transfer_mode == "direct" and hasattr(os, "O_DIRECT"):
+        try:
+            copy_file_direct(source, destination)
+            return "direct"
+        except OSError as e:
+            # e.g. tmpfs and some network filesystems do not support O_DIRECT
+            print_debug(
+                "\tO_DIRECT copy to %s failed (%s), using fadvise" % (destination, e)
+            )
+            transfer_mode = "fadvise"
+    if transfer_mode in ["direct", "fadvise"] and hasattr(os, "posix_fadvise"):
+        copy_file_fadvise(source, destination)
+        return "fadvise"
+    shutil.copyfile(source, destination)
+    return "buffered"
+
+
+def move_plot(source, destination_folder, transfer_mode=TRANSFER_MODE):
+    destination = os.path.join(destination_folder, os.path.basename(source))
+    if transfer_mode == "buffered":
+        shutil.move(source, destination)
+        return
+    try:
+        # same filesystem, nothing to copy
+        os.rename(source, destination)
+        return
+    except OSError:
+        pass
+
+    partial_destination = destination + ".tmp"
+    try:
+        copy_plot(source, partial_destination, transfer_mode)
+        shutil.copystat(source, partial_destination)
+        os.replace(partial_destination, destination)
+    except BaseException:
+        if os.path.exists(partial_destination):
+            os.remove(partial_destination)
+        raise
+    os.remove(source)
+
+
+def measure_transfer_modes(source, destination_folder, transfer_modes=TRANSFER_MODES):
+    source_size = os.path.getsize(source)
+    measurements = {}
+    for transfer_mode in transfer_modes:
+        # every mode starts with the source out of the page cache
+        source_fd = os.open(source, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        drop_file_cache(source_fd)
+        os.close(source_fd)
+
+        destination = os.path.join(
+            destination_folder, "%s.%s.tmp" % (os.path.basename(source), transfer_mode)
+        )
+        cached_start = getattr(psutil.virtual_memory(), "cached", 0)
+        cached_peak = [cached_start]
+        copying = threading.Event()
+        copying.set()
+
+        def sample_page_cache():
+            while copying.is_set():
+                cached_peak[0] = max(
+                    cached_peak[0], getattr(psutil.virtual_memory(), "cached", 0)
+                )
+                time.sleep(0.1)
+
+        sampler = threading.Thread(target=sample_page_cache)
+        sampler.start()
+        start_time = time.time()
+        try:
+            used_mode = copy_plot(source, destination, transfer_mode)
+            if used_mode == "buffered":
+                with open(destination, "rb+") as f:
+                    os.fsync(f.fileno())
+        finally:
+            elapsed_time = max(time.time() - start_time, 1e-6)
+            copying.clear()
+            sampler.join()
+            if os.path.exists(destination):
+                os.remove(destination)
+
+        measurements[transfer_mode] = {
+            "used_mode": used_mode,
+            "throughput_mib_s": source_size / 2 ** 20 / elapsed_time,
+            "page_cache_growth_mib": (cached_peak[0] - cached_start) / 2 ** 20,
+        }
+        print_debug(
+            "Mode %s (%s): %.2f MiB/s, page cache growth %.2f MiB"
+            % (
+                transfer_mode,
+                used_mode,
+                measurements[transfer_mode]["throughput_mib_s"],
+                measurements[transfer_mode]["page_cache_growth_mib"],
+            )
+        )
+
+    return measurements
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python chia_plotter_transfer.py <plot file> <destination folder>")
+        sys.exit(0)
+    measure_transfer_modes(sys.argv[1], sys.argv[2])
@@ -0,0 +1,252 @@
+"""
+This python script finds the best madmax parameters for the calculator it runs on.
+
+It works as follows:
+    1 - compute the fingerprint of the calculator (CPU model, logical cores, RAM and plotting drives)
+    2 - start from the madmax defaults: threads equal to the logical cores, 256 buckets and temp2 on the fast drive
+    3 - make short test plots (TUNING_K_FACTOR) changing one parameter at a time (threads, buckets for phases 1-2,
+        buckets for phases 3-4, temp2 layout) and keep the value with the shortest plot creation time, the search
+        is repeated until no parameter improves (at most TUNING_ROUNDS rounds)
+    4 - save the best configuration and its phase times into TUNING_FILE, chia_plotter_madmax.py uses it
+        automatically on the calculators with the same fingerprint
+
+HOW TO USE THE SCRIPT:
+    1 - configure chia_plotter_madmax.py as usual
+    2 - run this script once for each new calculator (or after changing its plotting drives)
+"""
+
+import os, sys, re, json, datetime
+import platform, hashlib, multiprocessing, subprocess, shutil
+import psutil
+
+# constants - only advanced users should change them
+TUNING_FILE = "chia_plot_tuning.json"
+TUNING_K_FACTOR = 26
+TUNING_ROUNDS = 3
+BUCKETS_CANDIDATES = [64, 128, 256, 512]
+MADMAX_PHASE_PATTERN = re.compile(r"Phase (\d) took ([\d.]+) sec")
+MADMAX_TOTAL_PATTERN = re.compile(r"Total plot creation time was ([\d.]+) sec")
+
+
+def print_debug(data=None):
+    if data != None:
+        print("[%s]\t" % (datetime.datetime.now()) + data)
+    else:
+        print()
+
+
+def retrieve_machine_fingerprint(plotting_slow_drive, plotting_fast_drive):
+    cpu_model = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu_model = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+
+    machine = {
+        "cpu_model": cpu_model,
+        "cpu_core_count": multiprocessing.cpu_count(),
+        "total_ram_gib": round(psutil.virtual_memory().total / 2 ** 30),
+        "plotting_slow_drive": plotting_slow_drive,
+        "plotting_fast_drive": plotting_fast_drive,
+    }
+    fingerprint = hashlib.sha256(
+        json.dumps(machine, sort_keys=True).encode()
+    ).hexdigest()[:16]
+    return fingerprint, machine
+
+
+def load_tuned_configuration(
+    plotting_slow_drive, plotting_fast_drive, tuning_file=TUNING_FILE
+):
+    fingerprint, machine = retrieve_machine_fingerprint(
+        plotting_slow_drive, plotting_fast_drive
+    )
+    try:
+        with open(tuning_file) as f:
+            return json.load(f).get(fingerprint)
+    except (OSError, ValueError):
+        return None
+
+
+def save_tuned_configuration(fingerprint, tuned_configuration, tuning_file=TUNING_FILE):
+    try:
+        with open(tuning_file) as f:
+            tuned_configurations = json.load(f)
+    except (OSError, ValueError):
+        tuned_configurations = {}
+    tuned_configurations[fingerprint] = tuned_configuration
+    with open(tuning_file, "w") as f:
+        json.dump(tuned_configurations, f, indent=4)
+
+
+def run_test_plot(
+    configuration,
+    madmax_chia_plotter_location,
+    plotting_slow_drive,
+    plotting_fast_drive,
+    farmer_key,
+    pool_key,
+    k_factor=TUNING_K_FACTOR,
+):
+    tuning_directory = os.path.join(plotting_slow_drive, "chia", "tuning")
+    temp_directory = os.path.join(tuning_directory, "temp")
+    if configuration["temp2_fast"]:
+        temp2_directory = os.path.join(plotting_fast_drive, "chia", "tuning_fast")
+    else:
+        temp2_directory = temp_directory
+    dest_directory = os.path.join(tuning_directory, "dest")
+    for directory in [temp_directory, temp2_directory, dest_directory]:
+        os.makedirs(directory, exist_ok=True)
+
+    command = [
+        madmax_chia_plotter_location,
+        "-k",
+        "%d" % k_factor,
+        "-n",
+        "1",
+        "-r",
+        "%d" % configuration["threads"],
+        "-u",
+        "%d" % configuration["buckets"],
+        "-v",
+        "%d" % configuration["buckets3"],
+        "-t",
+        temp_directory + os.sep,
+        "-2",
+        temp2_directory + os.sep,
+        "-d",
+        dest_directory + os.sep,
+        "-f",
+        farmer_key,
+        "-p",
+        pool_key,
+    ]
+    try:
+        output = subprocess.run(
+            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+        ).stdout
+    except OSError as e:
+        print_debug("\tError running madmax: %s" % e)
+        output = ""
+    finally:
+        shutil.rmtree(tuning_directory, ignore_errors=True)
+        if configuration["temp2_fast"]:
+            shutil.rmtree(temp2_directory, ignore_errors=True)
+
+    total_time = MADMAX_TOTAL_PATTERN.search(output)
+    if total_time == None:
+        print_debug("\tTest plot failed with configuration %s" % configuration)
+        return None
+    return {
+        "phase_times": {
+            phase: float(seconds)
+            for phase, seconds in MADMAX_PHASE_PATTERN.findall(output)
+        },
+        "total_time": float(total_time.group(1)),
+    }
+
+
+def tune_madmax_parameters(
+    madmax_chia_plotter_location,
+    plotting_slow_drive,
+    plotting_fast_drive,
+    farmer_key,
+    pool_key,
+    tuning_rounds=TUNING_ROUNDS,
+    buckets_candidates=BUCKETS_CANDIDATES,
+):
+    cpu_core_count = multiprocessing.cpu_count()
+    search_space = {
+        "threads": sorted(
+            set(
+                max(1, int(cpu_core_count * ratio))
+                for ratio in [0.25, 0.5, 0.75, 1, 1.5]
+            )
+        ),
+        "buckets": buckets_candidates,
+        "buckets3": buckets_candidates,
+        "temp2_fast": [True, False]
+        if plotting_fast_drive != plotting_slow_drive
+        else [False],
+    }
+    best_configuration = {
+        "threads": cpu_core_count,
+        "buckets": 256,
+        "buckets3": 256,
+        "temp2_fast": plotting_fast_drive != plotting_slow_drive,
+    }
+    results = {}
+
+    def evaluate(configuration):
+        key = json.dumps(configuration, sort_keys=True)
+        if key not in results:
+            print_debug("Test plot with configuration %s" % key)
+            results[key] = run_test_plot(
+                configuration,
+                madmax_chia_plotter_location,
+                plotting_slow_drive,
+                plotting_fast_drive,
+                farmer_key,
+                pool_key,
+            )
+            if results[key] != None:
+                print_debug(
+                    "\tplot created in %.1f seconds (phases %s)"
+                    % (results[key]["total_time"], results[key]["phase_times"])
+                )
+        return results[key]
+
+    best_result = evaluate(best_configuration)
+    if best_result == None:
+        return None
+
+    # coordinate descent: one parameter at a time, until nothing improves
+    for tuning_round in range(tuning_rounds):
+        improved = False
+        for parameter, candidates in search_space.items():
+            for candidate in candidates:
+                configuration = dict(best_configuration, **{parameter: candidate})
+                result = evaluate(configuration)
+                if result != None and result["total_time"] < best_result["total_time"]:
+                    best_configuration = configuration
+                    best_result = result
+                    improved = True
+        if not improved:
+            break
+
+    return dict(best_configuration, **best_result)
+
+
+if __name__ == "__main__":
+    from chia_plotter_madmax import (
+        MADMAX_CHIA_PLOTTER_LOCATION,
+        PLOTTING_SLOW_DRIVE,
+        PLOTTING_FAST_DRIVE,
+        FARMER_KEY,
+        POOL_KEY,
+    )
+
+    fingerprint, machine = retrieve_machine_fingerprint(
+        PLOTTING_SLOW_DRIVE, PLOTTING_FAST_DRIVE
+    )
+    print_debug("Tuning madmax for %s (fingerprint %s)" % (machine, fingerprint))
+    tuned_configuration = tune_madmax_parameters(
+        MADMAX_CHIA_PLOTTER_LOCATION,
+        PLOTTING_SLOW_DRIVE,
+        PLOTTING_FAST_DRIVE,
+        FARMER_KEY,
+        POOL_KEY,
+    )
+    if tuned_configuration == None:
+        print_debug("Unable to make a test plot, check the madmax configuration")
+        sys.exit(0)
+
+    tuned_configuration["machine"] = machine
+    save_tuned_configuration(fingerprint, tuned_configuration)
+    print_debug(
+        "Best configuration saved into %s: %s" % (TUNING_FILE, tuned_configuration)
+    )